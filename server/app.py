@@ -1,17 +1,40 @@
 from datetime import datetime
 import json
-from flask import Flask, request, send_from_directory, jsonify, make_response, url_for, abort
+from flask import Flask, Response, request, send_file, send_from_directory, jsonify, make_response, url_for, abort, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
+from sqlalchemy.orm import joinedload, selectinload
 import os
-from models import db, User, Plant, CareSchedule, Tip, Layout, ForumPost, Comment
+import gzip
+import logging
+from models import db, User, Plant, Species, CareSchedule, Tip, Layout, ForumPost, Comment, record_changes, delete_user_data, normalize_species_name
+from sync import full_snapshot, changes_since
+from ratelimit import RateLimiter
+from replicas import ReplicaRouter
+from compression import Compressor, gzip_stream
+from backup import Importer, export_lines, CHUNK_SIZE
+from typeahead import Typeahead, requested_kinds
+from concurrency import expected_versions, versioned_update, version_conflict, version_etag
+from calendar_feed import CalendarFeed
+from ranking import ForumRanking, SORTS
+from profiler import QueryProfiler
+from threads import post_threads, comment_thread, subtree_rows, MAX_DEPTH
+from layout_render import LayoutRenderer, RenderTimeout, TILE_SIZES, MAX_COLUMNS, MIMETYPES
+from shards import ShardRouter, pin_user_shard, parse_shard_uris
+from weather import WeatherAdjuster
+from recommendations import TipRecommender
+from memory import MemoryGuard
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///greenthumb.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///greenthumb.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_REPLICA_URIS'] = [uri for uri in os.environ.get('SQLALCHEMY_REPLICA_URIS', '').split(',') if uri]  # Comma-separated; empty disables replica reads
+app.config['SQLALCHEMY_SHARD_URIS'] = parse_shard_uris(os.environ.get('SQLALCHEMY_SHARD_URIS', ''))  # Comma-separated name=uri; empty keeps user data on the primary
 app.config['SECRET_KEY'] = 'you-will-never-guess'
 app.config['JWT_SECRET_KEY'] = 'jwt-secret-string'
 app.config['JWT_TOKEN_LOCATION'] = ['cookies']
@@ -20,12 +43,43 @@ app.config['JWT_REFRESH_COOKIE_PATH'] = '/refresh'
 app.config['JWT_COOKIE_CSRF_PROTECT'] = False
 app.config['UPLOAD_FOLDER'] = 'uploads' 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # Limit upload size to 16 MB
+app.config['IMPORT_MAX_CONTENT_LENGTH'] = 1024 * 1024 * 1024  # /import streams at constant memory, so it gets its own limit
+app.config['RATELIMIT_BACKEND'] = 'sqlite:///' + os.path.join(app.instance_path, 'ratelimit.db')  # Shared by all gunicorn workers
+app.config['RATELIMIT_DEFAULT'] = '120/minute'
+app.config['RATELIMIT_ROUTES'] = {
+    'login': '10/minute',
+    'register': '5/minute',
+    'add_forum_post': '10/minute',
+    'update_forum_post': '30/minute',
+    'add_comment': '30/minute',
+    'update_comment': '30/minute',
+}
+app.config['SHED_MAX_QUEUE_MS'] = 1000  # Needs the proxy to send X-Request-Start, e.g. nginx: proxy_set_header X-Request-Start "t=${msec}";
+app.config['SHED_MAX_LATENCY_MS'] = 2000
+app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED') == '1'  # Query timings, slow-query log and X-Profile dumps
+app.config['PROFILER_TOKEN'] = os.environ.get('PROFILER_TOKEN')  # X-Profile must carry it; cProfile dumps are off without it
+app.config['WEATHER_PROVIDER'] = os.environ.get('WEATHER_PROVIDER')  # 'fixture' or 'open-meteo'; unset disables weather adjustments
+app.config['MEMORY_TRACKING'] = os.environ.get('MEMORY_TRACKING') == '1'  # tracemalloc peaks per route, reported at /admin/memory
+app.config['MEMORY_RSS_LIMIT_MB'] = int(os.environ.get('MEMORY_RSS_LIMIT_MB', 0)) or None  # Recycle gunicorn workers above this RSS
+app.config['MEMORY_ADMIN_TOKEN'] = os.environ.get('MEMORY_ADMIN_TOKEN')
 
 CORS(app, supports_credentials=True, origins=["https://greenthumbapp-jozxzp24j-riko-04s-projects.vercel.app"])
 
 db.init_app(app)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
+limiter = RateLimiter(app)
+replicas = ReplicaRouter(app)
+compressor = Compressor(app)
+typeahead = Typeahead(app)
+calendar_feed = CalendarFeed(app)
+ranking = ForumRanking(app)
+profiler = QueryProfiler(app)
+layout_renderer = LayoutRenderer(app)
+shards = ShardRouter(app)
+weather = WeatherAdjuster(app)
+tip_recommender = TipRecommender(app)
+memory_guard = MemoryGuard(app)
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -65,11 +119,11 @@ def login():
     user = User.query.filter_by(email=email).first()
     
     if user is None:
-        print("User not found")  # Debug statement
+        app.logger.debug('Login failed for %s: user not found', email)
         return jsonify({"msg": "User not found"}), 401
     
     if not user.check_password(password):
-        print("Invalid password")  # Debug statement
+        app.logger.debug('Login failed for %s: invalid password', email)
         return jsonify({"msg": "Invalid password"}), 401
     
     access_token = create_access_token(identity=user.id)
@@ -97,6 +151,31 @@ def logout():
     response.delete_cookie('refresh_jwt')
     return response
 
+@app.route('/account', methods=['DELETE'])
+@jwt_required()
+def delete_account():
+    data = request.get_json(silent=True) or {}
+    user = User.query.get_or_404(get_jwt_identity())
+
+    if not user.check_password(data.get('password', '')):
+        return jsonify({"msg": "Invalid password"}), 401
+
+    user_id = user.id  # The row is gone after commit, so keep the id
+
+    # Their comments on other people's threads go too; those threads' counts are redone afterwards
+    commented_posts = [post_id for post_id, in db.session.query(Comment.post_id).filter(Comment.user_id == user_id).distinct()]
+    delete_user_data(user_id)
+    ranking.refresh_activity(commented_posts)
+    db.session.commit()
+    typeahead.invalidate()
+    tip_recommender.invalidate()
+    calendar_feed.invalidate(user_id)
+
+    response = make_response(jsonify({"msg": "Account deleted successfully"}), 200)
+    response.delete_cookie('jwt')
+    response.delete_cookie('refresh_jwt')
+    return response
+
 @app.route('/plants', methods=['POST'])
 @jwt_required()
 def add_plant():
@@ -113,10 +192,12 @@ def add_plant():
     if not img_url:
         return jsonify({"error": "Image URL is required"}), 400
 
-    # Save the plant details to the database
-    new_plant = Plant(name=name, description=description, img_url=img_url, user_id=user_id)
+    # Save the plant details to the database, sharing the species record with other users
+    new_plant = Plant(name=name, user_id=user_id)
+    new_plant.set_species(name, description, img_url)
     db.session.add(new_plant)
     db.session.commit()
+    typeahead.put('plant', (user_id, new_plant.id), new_plant.name)
 
     return jsonify({"message": "Plant added successfully"}), 201
 
@@ -126,28 +207,37 @@ def add_plant():
 def get_plants():
     user_id = get_jwt_identity()
     plants = Plant.query.filter_by(user_id=user_id).all()
-    return jsonify([{"id": plant.id, "name": plant.name, "img_url": plant.img_url, "description": plant.description} for plant in plants]), 200
+    return jsonify([{"id": plant.id, "name": plant.name, "img_url": plant.display_img_url, "description": plant.display_description, "version": plant.version} for plant in plants]), 200
 
 @app.route('/plants/<int:plant_id>', methods=['PATCH'])
 @jwt_required()
 def update_plant(plant_id):
     data = request.get_json()
-    plant = Plant.query.get_or_404(plant_id)
     user_id = get_jwt_identity()
-    
-    if plant.user_id != user_id:
+    versions = expected_versions()
+
+    # Written with one conditional UPDATE; a rename also looks up (or adds) the new species first
+    values = {}
+    species = None
+    if data.get('name'):
+        species = Species.for_name(data['name'])
+        values = {'name': data['name'], 'species_id': species.id}
+    values.update(Plant.override_values(data, species))
+
+    row, status = versioned_update(Plant, plant_id, user_id, versions, values)
+    if status == 404:
+        abort(404)
+    if status == 403:
         return jsonify({"msg": "Unauthorized"}), 403
-    
-    if 'name' in data:
-        plant.name = data['name']
-    if 'img_url' in data:
-        plant.img_url = data['img_url'] 
-    if 'description' in data:
-        plant.description = data['description']
-    
+    if status == 409:
+        return version_conflict(row.version)
+
     db.session.commit()
+    if 'name' in values:
+        typeahead.put('plant', (user_id, plant_id), values['name'])
+        calendar_feed.invalidate(user_id)  # Event titles include the plant name
     
-    return jsonify({"msg": "Plant updated successfully"}), 200
+    return jsonify({"msg": "Plant updated successfully", "version": row.version}), 200, version_etag(row.version)
 
 @app.route('/plants/<int:plant_id>', methods=['DELETE'])
 @jwt_required()
@@ -158,17 +248,50 @@ def delete_plant(plant_id):
     if plant.user_id != user_id:
         return jsonify({"msg": "Unauthorized"}), 403
     
+    # Care schedules go with the plant via ON DELETE CASCADE; log them so synced clients drop them too
+    record_changes(db.session, 'care_schedule', db.session.query(CareSchedule.id, CareSchedule.user_id).filter_by(plant_id=plant.id), 'delete')
     db.session.delete(plant)
     db.session.commit()
+    typeahead.discard('plant', (user_id, plant_id))
+    calendar_feed.invalidate(user_id)
     
     return jsonify({"msg": "Plant deleted successfully"}), 200
 
+# Species catalogue prefix search, for autocomplete when adding a plant
+@app.route('/species/search', methods=['GET'])
+@jwt_required()
+def search_species():
+    q = normalize_species_name(request.args.get('q', ''))
+    limit = min(request.args.get('limit', 10, type=int), 50)
+
+    if not q:
+        return jsonify([]), 200
+
+    # A range on the unique index instead of LIKE, so the lookup is an index seek on any database
+    upper = q[:-1] + chr(ord(q[-1]) + 1)
+    species = (
+        Species.query
+        .filter(Species.normalized_name >= q, Species.normalized_name < upper)
+        .order_by(Species.normalized_name)
+        .limit(limit)
+        .all()
+    )
+    return jsonify([s.to_dict() for s in species]), 200
+
+# Suggestions for plant names, tip titles and forum thread titles while typing
+@app.route('/typeahead', methods=['GET'])
+@jwt_required()
+def get_typeahead():
+    q = request.args.get('q', '')
+    limit = min(request.args.get('limit', 8, type=int), 25)
+    return jsonify(typeahead.search(q, requested_kinds(), limit, get_jwt_identity())), 200
+
 # CareSchedule CRUD
 @app.route('/care_schedules', methods=['POST'])
 @jwt_required()
 def add_care_schedule():
     data = request.get_json()
-    print(f"Received data: {data}")  # Debugging line
+    app.logger.debug('Received care schedule: %s', data)
 
     task = data.get('task')
     schedule_date = data.get('schedule_date')
@@ -193,6 +316,7 @@ def add_care_schedule():
     )
     db.session.add(new_schedule)
     db.session.commit()
+    calendar_feed.invalidate(user_id)
 
     return jsonify({"msg": "Care schedule added successfully", "schedule": new_schedule.to_dict()}), 201
 
@@ -218,18 +342,38 @@ def get_care_schedules():
 @app.route('/care_schedules/<int:id>', methods=['PATCH'])
 @jwt_required()
 def update_care_schedule(id):
-    schedule = CareSchedule.query.get_or_404(id)
     user_id = get_jwt_identity()
+    versions = expected_versions()
 
-    if schedule.user_id != user_id:
+    values = {field: request.json[field] for field in ('task', 'interval') if field in request.json}
+    if 'schedule_date' in request.json:
+        values['schedule_date'] = datetime.strptime(request.json['schedule_date'], '%Y-%m-%d').date()
+
+    plant_name = db.select(Plant.name).where(Plant.id == CareSchedule.plant_id).scalar_subquery().label('plant_name')
+    row, status = versioned_update(
+        CareSchedule, id, user_id, versions, values,
+        returning=(CareSchedule.task, CareSchedule.schedule_date, CareSchedule.interval, CareSchedule.plant_id, plant_name)
+    )
+    if status == 404:
+        abort(404)
+    if status == 403:
         return jsonify({"error": "Unauthorized access"}), 403
+    if status == 409:
+        return version_conflict(row.version)
 
-    schedule.task = request.json.get('task', schedule.task)
-    schedule.schedule_date = datetime.strptime(request.json.get('schedule_date', schedule.schedule_date.strftime('%Y-%m-%d')), '%Y-%m-%d')
-    schedule.interval = request.json.get('interval', schedule.interval)
-    
     db.session.commit()
-    return jsonify({"msg": "Care schedule updated successfully", "schedule": schedule.to_dict()}), 200
+    calendar_feed.invalidate(user_id)
+    schedule = {
+        'id': id,
+        'task': row.task,
+        'schedule_date': row.schedule_date.strftime('%Y-%m-%d'),
+        'interval': row.interval,
+        'plant_id': row.plant_id,
+        'plant_name': row.plant_name,
+        'user_id': user_id,
+        'version': row.version
+    }
+    return jsonify({"msg": "Care schedule updated successfully", "schedule": schedule}), 200, version_etag(row.version)
 
 @app.route('/care_schedules/<int:id>', methods=['DELETE'])
 @jwt_required()
@@ -242,14 +386,79 @@ def delete_care_schedule(id):
 
     db.session.delete(schedule)
     db.session.commit()
+    calendar_feed.invalidate(user_id)
     return jsonify({"msg": "Care schedule deleted successfully"}), 200
 
+# iCalendar feed of care schedules; calendar apps cannot log in, so the feed URL carries a secret token
+@app.route('/care_schedules/feed', methods=['POST'])
+@jwt_required()
+def create_calendar_feed():
+    user = User.query.get_or_404(get_jwt_identity())
+    token = user.reset_calendar_token()
+    db.session.commit()
+    return jsonify({"url": url_for('get_calendar_feed', token=token, _external=True)}), 201
+
+@app.route('/care_schedules/feed', methods=['DELETE'])
+@jwt_required()
+def delete_calendar_feed():
+    user = User.query.get_or_404(get_jwt_identity())
+    user.calendar_token_hash = None
+    db.session.commit()
+    calendar_feed.invalidate(user.id)
+    return jsonify({"msg": "Calendar feed disabled"}), 200
+
+@app.route('/care_schedules.ics', methods=['GET'])
+def get_calendar_feed():
+    user = User.by_calendar_token(request.args.get('token'))
+    if user is None:
+        abort(404)
+    pin_user_shard(user.id)  # No JWT here to pick the shard from
+    return calendar_feed.response(user.id)
+
+# Watering tasks move off rainy days once a location is set; only its forecast grid cell is kept
+@app.route('/account/location', methods=['PUT'])
+@jwt_required()
+def set_location():
+    data = request.get_json(silent=True) or {}
+    try:
+        latitude, longitude = float(data['latitude']), float(data['longitude'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "latitude and longitude are required numbers"}), 400
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return jsonify({"error": "latitude or longitude out of range"}), 400
+
+    user = User.query.get_or_404(get_jwt_identity())
+    user.set_location(latitude, longitude)
+    db.session.commit()
+    return jsonify({"weather_cell": user.weather_cell}), 200
+
+@app.route('/account/location', methods=['DELETE'])
+@jwt_required()
+def delete_location():
+    user = User.query.get_or_404(get_jwt_identity())
+    user.set_location(None, None)
+    db.session.commit()
+    return jsonify({"msg": "Location removed"}), 200
+
 # Route to fetch all tips
 @app.route('/tips', methods=['GET'])
 @jwt_required()
 def get_tips():
     tips = Tip.query.all()
-    tips_list = [{'id': tip.id, 'title': tip.title, 'content': tip.content, 'author': tip.user.username} for tip in tips]
+    tips_list = [{'id': tip.id, 'title': tip.title, 'content': tip.content, 'author': tip.user.username, 'version': tip.version} for tip in tips]
+    return jsonify(tips_list), 200
+
+# Tips ranked by how well they match the user's plants and upcoming care tasks
+@app.route('/tips/recommended', methods=['GET'])
+@jwt_required()
+def get_recommended_tips():
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    ranked = tip_recommender.recommend(get_jwt_identity(), limit)
+    tips = {tip.id: tip for tip in Tip.query.options(joinedload(Tip.user)).filter(Tip.id.in_([tip_id for tip_id, _ in ranked]))}
+    tips_list = [
+        {'id': tip.id, 'title': tip.title, 'content': tip.content, 'author': tip.user.username, 'version': tip.version, 'score': round(score, 4)}
+        for tip, score in ((tips.get(tip_id), score) for tip_id, score in ranked) if tip is not None
+    ]
     return jsonify(tips_list), 200
 
 # Route to add a new tip
@@ -266,6 +475,8 @@ def add_tip():
     new_tip = Tip(title=data['title'], content=data['content'], user_id=user.id)
     db.session.add(new_tip)
     db.session.commit()
+    typeahead.put('tip', new_tip.id, new_tip.title)
+    tip_recommender.put(new_tip.id, new_tip.title, new_tip.content)
 
     return jsonify({'message': 'Tip added successfully'}), 201
 
@@ -273,25 +484,26 @@ def add_tip():
 @app.route('/tips/<int:tip_id>', methods=['PATCH'])
 @jwt_required()
 def update_tip(tip_id):
+    versions = expected_versions()
     try:
         data = request.json
-        tip = Tip.query.get(tip_id)
-        if not tip:
-            return jsonify({'error': 'Tip not found'}), 404
-
         current_user_id = get_jwt_identity()
 
-        if tip.user_id != current_user_id:
+        values = {field: data[field] for field in ('title', 'content') if field in data}
+        row, status = versioned_update(Tip, tip_id, current_user_id, versions, values, returning=(Tip.title, Tip.content))
+        if status == 404:
+            return jsonify({'error': 'Tip not found'}), 404
+        if status == 403:
             return jsonify({'error': 'Unauthorized action'}), 403
-
-        if 'title' in data:
-            tip.title = data['title']
-        if 'content' in data:
-            tip.content = data['content']
+        if status == 409:
+            return version_conflict(row.version)
 
         db.session.commit()
+        if 'title' in values:
+            typeahead.put('tip', tip_id, values['title'])
+        tip_recommender.put(tip_id, row.title, row.content)
 
-        return jsonify({'message': 'Tip updated successfully'}), 200
+        return jsonify({'message': 'Tip updated successfully', 'version': row.version}), 200, version_etag(row.version)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -312,6 +524,8 @@ def delete_tip(tip_id):
 
         db.session.delete(tip)
         db.session.commit()
+        typeahead.discard('tip', tip_id)
+        tip_recommender.discard(tip_id)
 
         return jsonify({'message': 'Tip deleted successfully'}), 200
     except Exception as e:
@@ -348,21 +562,38 @@ def create_layout():
 @jwt_required()
 def update_layout(id):
     user_id = get_jwt_identity()
-    layout = Layout.query.filter_by(id=id, user_id=user_id).first()
-    if not layout:
-        abort(404, description='Layout not found')
+    versions = expected_versions()
 
     data = request.json
+    values = {}
     if 'name' in data:
-        layout.name = data['name']
+        values['name'] = data['name']
     if 'layout_data' in data:
         try:
-            layout.layout_data = json.dumps(data['layout_data'])  # Serialize updated layout_data
+            values['layout_data'] = json.dumps(data['layout_data'])  # Serialize updated layout_data
         except (TypeError, ValueError):
             abort(400, description='Invalid layout data format')
 
+    row, status = versioned_update(
+        Layout, id, user_id, versions, values,
+        returning=(Layout.name, Layout.layout_data, Layout.created_at, Layout.updated_at)
+    )
+    if status in (404, 403):
+        abort(404, description='Layout not found')
+    if status == 409:
+        return version_conflict(row.version)
+
     db.session.commit()
-    return jsonify(layout.to_dict()), 200
+    layout = {
+        'id': id,
+        'name': row.name,
+        'layout_data': json.loads(row.layout_data),
+        'user_id': user_id,
+        'created_at': row.created_at,
+        'updated_at': row.updated_at,
+        'version': row.version
+    }
+    return jsonify(layout), 200, version_etag(row.version)
 
 @app.route('/layouts/<int:id>', methods=['DELETE'])
 @jwt_required()
@@ -374,22 +605,65 @@ def delete_layout(id):
     
     db.session.delete(layout)
     db.session.commit()
+    layout_renderer.discard(user_id, id)
     return '', 204
 
+# Server-side image of a garden plan, so clients need not fetch every plant image to draw it
+@app.route('/layouts/<int:id>/render.<any(png, svg):fmt>', methods=['GET'])
+@jwt_required()
+def render_layout(id, fmt):
+    if fmt not in layout_renderer.formats():
+        abort(404, description='PNG rendering is not available on this server')
+    size = request.args.get('size', 'medium')
+    if size not in TILE_SIZES:
+        abort(400, description='size must be one of: ' + ', '.join(TILE_SIZES))
+    columns = min(max(request.args.get('columns', 3, type=int), 1), MAX_COLUMNS)
+
+    user_id = get_jwt_identity()
+    updated_at = db.session.execute(db.select(Layout.updated_at).where(Layout.id == id, Layout.user_id == user_id)).first()
+    if updated_at is None:
+        abort(404, description='Layout not found')
+    updated_at = updated_at[0]
 
-# Route to fetch all forum posts with comments
+    path = layout_renderer.cached(user_id, id, updated_at, size, columns, fmt)
+    if path is None:
+        layout_data = db.session.execute(db.select(Layout.layout_data).where(Layout.id == id, Layout.user_id == user_id)).scalar()
+        try:
+            path = layout_renderer.render(user_id, id, updated_at, json.loads(layout_data), size, columns, fmt)
+        except RenderTimeout:
+            return jsonify({'error': 'Rendering took too long, try a smaller size'}), 503
+    return send_file(path, mimetype=MIMETYPES[fmt], conditional=True, max_age=0)
+
+
+# Route to fetch forum posts with comments; ?sort=hot|new|active returns one ranked page
 @app.route('/forum_posts', methods=['GET'])
 @jwt_required()
 def get_forum_posts():
     try:
-        posts = ForumPost.query.all()
+        sort = request.args.get('sort')
+        if sort is None:
+            posts = ForumPost.query.all()
+        elif sort not in SORTS:
+            return jsonify({'error': 'sort must be one of: ' + ', '.join(SORTS)}), 400
+        else:
+            limit = min(request.args.get('limit', app.config['FORUM_PAGE_SIZE'], type=int), 100)
+            posts = (
+                ForumPost.query
+                .options(joinedload(ForumPost.user), selectinload(ForumPost.comments).joinedload(Comment.user))
+                .order_by(*SORTS[sort])
+                .limit(limit)
+                .all()
+            )
         posts_list = [{
             'id': post.id,
             'title': post.title,
             'content': post.content,
             'author': post.user.username,
             'created_at': post.created_at,
-            'comments': [{'id': comment.id, 'content': comment.content, 'author': comment.user.username, 'date_created': comment.date_created} for comment in post.comments]
+            'comment_count': post.comment_count,
+            'last_activity_at': post.last_activity_at,
+            'version': post.version,
+            'comments': [{'id': comment.id, 'parent_id': comment.parent_id, 'content': comment.content, 'author': comment.user.username, 'date_created': comment.date_created, 'version': comment.version} for comment in post.comments]
         } for post in posts]
         return jsonify(posts_list), 200
     except Exception as e:
@@ -400,7 +674,7 @@ def get_forum_posts():
 @jwt_required()
 def add_forum_post():
     data = request.get_json()
-    print("Received data:", data)
+    app.logger.debug('Received forum post: %s', data)
     current_user_id = get_jwt_identity()
     user = User.query.get(current_user_id)
 
@@ -419,6 +693,7 @@ def add_forum_post():
         new_post = ForumPost(title=title, content=content, user_id=user.id)
         db.session.add(new_post)
         db.session.commit()
+        typeahead.put('forum_post', new_post.id, new_post.title)
 
         return jsonify({
             'message': 'Forum post added successfully',
@@ -427,11 +702,12 @@ def add_forum_post():
                 'title': new_post.title,
                 'content': new_post.content,
                 'user_id': new_post.user_id,
-                'created_at': new_post.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                'created_at': new_post.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                'version': new_post.version
             }
         }), 201
     except Exception as e:
-        print(f"Error adding forum post: {e}")
+        app.logger.exception('Error adding forum post: %s', e)
         return jsonify({'error': 'An error occurred while adding the forum post.'}), 500
 
 
@@ -441,16 +717,22 @@ def add_forum_post():
 def update_forum_post(post_id):
     data = request.json
     current_user_id = get_jwt_identity()
-    post = ForumPost.query.get_or_404(post_id)
+    versions = expected_versions()
 
-    if post.user_id != current_user_id:
+    values = {field: data[field] for field in ('title', 'content') if field in data}
+    row, status = versioned_update(ForumPost, post_id, current_user_id, versions, values)
+    if status == 404:
+        abort(404)
+    if status == 403:
         return jsonify({'error': 'Permission denied'}), 403
+    if status == 409:
+        return version_conflict(row.version)
 
     try:
-        post.title = data.get('title', post.title)
-        post.content = data.get('content', post.content)
         db.session.commit()
-        return jsonify({'message': 'Forum post updated successfully'}), 200
+        if 'title' in values:
+            typeahead.put('forum_post', post_id, values['title'])
+        return jsonify({'message': 'Forum post updated successfully', 'version': row.version}), 200, version_etag(row.version)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -465,8 +747,10 @@ def delete_forum_post(post_id):
         return jsonify({'error': 'Permission denied'}), 403
 
     try:
+        record_changes(db.session, 'comment', db.session.query(Comment.id, Comment.user_id).filter_by(post_id=post.id), 'delete')
         db.session.delete(post)
         db.session.commit()
+        typeahead.discard('forum_post', post_id)
         return jsonify({'message': 'Forum post deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -483,11 +767,21 @@ def add_comment(post_id):
     if not user:
         return jsonify({'error': 'User not found'}), 404
 
+    # Replies name the comment they answer, which must be on the same post
+    parent_id = data.get('parent_id')
+    if parent_id is not None:
+        parent = Comment.query.get(parent_id)
+        if parent is None or parent.post_id != post.id:
+            return jsonify({'error': 'Parent comment not found on this post'}), 400
+        if parent.depth >= MAX_DEPTH:
+            return jsonify({'error': f'Replies can only be nested {MAX_DEPTH} levels deep'}), 400
+
     try:
-        new_comment = Comment(content=data['content'], user_id=user.id, post_id=post.id)
+        new_comment = Comment(content=data['content'], user_id=user.id, post_id=post.id, parent_id=parent_id, date_created=datetime.utcnow())
         db.session.add(new_comment)
+        ranking.comment_added(post.id, new_comment.date_created)
         db.session.commit()
-        return jsonify({'message': 'Comment added successfully', 'comment': {'id': new_comment.id, 'content': new_comment.content}}), 201
+        return jsonify({'message': 'Comment added successfully', 'comment': {'id': new_comment.id, 'content': new_comment.content, 'parent_id': new_comment.parent_id, 'version': new_comment.version}}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -497,15 +791,20 @@ def add_comment(post_id):
 def update_comment(comment_id):
     data = request.json
     current_user_id = get_jwt_identity()
-    comment = Comment.query.get_or_404(comment_id)
+    versions = expected_versions()
 
-    if comment.user_id != current_user_id:
+    values = {'content': data['content']} if 'content' in data else {}
+    row, status = versioned_update(Comment, comment_id, current_user_id, versions, values)
+    if status == 404:
+        abort(404)
+    if status == 403:
         return jsonify({'error': 'Permission denied'}), 403
+    if status == 409:
+        return version_conflict(row.version)
 
     try:
-        comment.content = data.get('content', comment.content)
         db.session.commit()
-        return jsonify({'message': 'Comment updated successfully'}), 200
+        return jsonify({'message': 'Comment updated successfully', 'version': row.version}), 200, version_etag(row.version)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -520,12 +819,116 @@ def delete_comment(comment_id):
         return jsonify({'error': 'Permission denied'}), 403
 
     try:
+        # Replies go with the comment via ON DELETE CASCADE; log them so synced clients drop them too
+        removed = subtree_rows(comment)
+        record_changes(db.session, 'comment', [(row.id, row.user_id) for row in removed if row.id != comment.id], 'delete')
         db.session.delete(comment)
+        ranking.comments_removed(comment.post_id, [(row.id, row.date_created) for row in removed])
         db.session.commit()
         return jsonify({'message': 'Comment deleted successfully'}), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _thread_args():
+    max_replies = request.args.get('replies', type=int)
+    max_depth = request.args.get('depth', type=int)
+    return max_replies, max_depth
+
+# Threaded comments: the first `limit` top-level comments with up to `replies` replies each
+@app.route('/forum_posts/<int:post_id>/comments', methods=['GET'])
+@jwt_required()
+def get_comment_threads(post_id):
+    post = ForumPost.query.get_or_404(post_id)
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    max_replies, max_depth = _thread_args()
+    return jsonify(post_threads(post.id, limit, max_replies, max_depth)), 200
+
+# A comment with every reply under it
+@app.route('/comments/<int:comment_id>/thread', methods=['GET'])
+@jwt_required()
+def get_comment_thread(comment_id):
+    comment = Comment.query.get_or_404(comment_id)
+    max_replies, max_depth = _thread_args()
+    return jsonify(comment_thread(comment, max_replies, max_depth)), 200
+
+
+# Delta sync for offline clients
+@app.route('/sync', methods=['GET'])
+@jwt_required()
+def sync():
+    user_id = get_jwt_identity()
+    since = request.args.get('since')
+
+    if since is None:
+        return jsonify(full_snapshot(user_id)), 200
+
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'error': 'Invalid sync token'}), 400
+
+    return jsonify(changes_since(user_id, since)), 200
+
+# Streaming backup of a user's garden data
+@app.route('/export', methods=['GET'])
+@jwt_required()
+def export_data():
+    user_id = get_jwt_identity()
+    export_format = request.args.get('format', 'ndjson')
+
+    if export_format == 'ndjson':
+        return Response(
+            stream_with_context(export_lines(user_id)),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=greenthumb-export.ndjson'}
+        )
+    if export_format == 'gzip':
+        return Response(
+            stream_with_context(gzip_stream(export_lines(user_id), 6)),
+            mimetype='application/gzip',
+            headers={'Content-Disposition': 'attachment; filename=greenthumb-export.ndjson.gz'}
+        )
+    return jsonify({'error': 'Format must be ndjson or gzip'}), 400
+
+@app.route('/import', methods=['POST'])
+@jwt_required()
+def import_data():
+    user_id = get_jwt_identity()
+    # Not request.stream, which would hold the upload to MAX_CONTENT_LENGTH
+    stream = get_input_stream(request.environ, max_content_length=app.config['IMPORT_MAX_CONTENT_LENGTH'])
+    if request.headers.get('Content-Encoding') == 'gzip' or request.mimetype == 'application/gzip':
+        stream = gzip.GzipFile(fileobj=stream)
+
+    def generate():
+        # The body is read while progress is written back, so neither side is held in memory
+        importer = Importer(user_id)
+        line_number = 0
+        try:
+            for line_number, line in enumerate(stream, 1):
+                if line.strip():
+                    importer.add(json.loads(line))
+                if line_number % CHUNK_SIZE == 0:
+                    importer.flush()
+                    yield json.dumps(dict(importer.progress(), status='in_progress', lines=line_number)) + '\n'
+            importer.finish()
+            db.session.commit()
+            typeahead.invalidate()
+            tip_recommender.invalidate()
+            calendar_feed.invalidate(user_id)
+            yield json.dumps(dict(importer.progress(), status='done', lines=line_number)) + '\n'
+        except KeyError as e:
+            db.session.rollback()
+            yield json.dumps({'status': 'error', 'error': f'Missing field {e}', 'line': line_number}) + '\n'
+        except RequestEntityTooLarge:
+            # Chunked uploads only find out once the limit is crossed
+            db.session.rollback()
+            limit_mb = app.config['IMPORT_MAX_CONTENT_LENGTH'] // (1024 * 1024)
+            yield json.dumps({'status': 'error', 'error': f'Upload is larger than {limit_mb} MB', 'line': line_number}) + '\n'
+        except (ValueError, TypeError, OSError, EOFError) as e:
+            db.session.rollback()
+            yield json.dumps({'status': 'error', 'error': str(e), 'line': line_number}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 # File upload endpoint
@@ -533,15 +936,30 @@ def delete_comment(comment_id):
 def uploaded_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+# Heaviest routes by peak allocation across workers, for sizing them; needs MEMORY_ADMIN_TOKEN
+@app.route('/admin/memory', methods=['GET'])
+def get_memory_report():
+    if not memory_guard.admin_authorized():
+        abort(404)
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify(memory_guard.report(limit)), 200
+
 # Debugging middleware
 @app.before_request
 def log_request_info():
+    if not app.logger.isEnabledFor(logging.DEBUG):
+        return
     app.logger.debug('Headers: %s', request.headers)
-    app.logger.debug('Body: %s', request.get_data())
+    # Reading a streamed upload here would consume it before the route sees it
+    if request.mimetype not in ('application/x-ndjson', 'application/gzip'):
+        app.logger.debug('Body: %s', request.get_data())
 
 @app.after_request
 def log_response_info(response):
-    app.logger.debug('Response: %s', response.get_data())
+    if not app.logger.isEnabledFor(logging.DEBUG):
+        return response
+    # Reading a streamed body here would buffer the whole stream in memory
+    app.logger.debug('Response: %s', '<streamed>' if response.is_streamed else response.get_data())
     return response
 
 if __name__ == '__main__':
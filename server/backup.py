@@ -0,0 +1,150 @@
+import json
+from datetime import date, datetime
+from sqlalchemy import func, insert, select
+from models import db, Plant, Species, CareSchedule, Layout, Tip, link_species, record_changes
+
+# Export order matters: plants come before the schedules and layouts that reference them
+EXPORT_MODELS = {'plant': Plant, 'care_schedule': CareSchedule, 'layout': Layout, 'tip': Tip}
+CHUNK_SIZE = 500
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def export_records(user_id):
+    """Yield every row the user owns as a dict, fetching in chunks rather than all at once."""
+    for record_type, model in EXPORT_MODELS.items():
+        table = model.__table__
+        columns = [column for column in table.columns if column.name not in ('user_id', 'species_id', 'version')]
+        query = select(*columns)
+        if model is Plant:
+            # Export what the user sees, with catalogue values filled in, so an import elsewhere is complete
+            species = Species.__table__
+            columns = [column for column in columns if column.name not in ('description', 'img_url')]
+            query = select(
+                *columns,
+                func.coalesce(table.c.description, species.c.description).label('description'),
+                func.coalesce(table.c.img_url, species.c.img_url).label('img_url')
+            ).outerjoin(species, species.c.id == table.c.species_id)
+        result = db.session.execute(
+            query.where(table.c.user_id == user_id).order_by(table.c.id)
+            .execution_options(yield_per=CHUNK_SIZE)
+        )
+        for row in result.mappings():
+            record = dict(row, type=record_type)
+            if record_type == 'layout':
+                record['layout_data'] = json.loads(record['layout_data'])
+            yield record
+
+
+def export_lines(user_id):
+    for record in export_records(user_id):
+        yield json.dumps(record, default=_json_default) + '\n'
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+class Importer:
+    """Inserts exported records for a user in chunks, giving every row a new id.
+
+    Old plant ids are mapped to the new ones so care schedules and layout items
+    keep pointing at the right plant. Only the id map grows with the input.
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.plant_ids = {}
+        self.buffers = {record_type: [] for record_type in EXPORT_MODELS}
+        self.imported = dict.fromkeys(EXPORT_MODELS, 0)
+        self.skipped = 0
+
+    def add(self, record):
+        if not isinstance(record, dict):
+            raise ValueError('Each line must be a JSON object')
+        record_type = record.get('type')
+        if record_type not in self.buffers:
+            raise ValueError(f'Unknown record type: {record_type}')
+        self.buffers[record_type].append(record)
+        if len(self.buffers[record_type]) >= CHUNK_SIZE:
+            self.flush()
+
+    def flush(self):
+        for record_type in EXPORT_MODELS:
+            records = self.buffers[record_type]
+            if records:
+                self.buffers[record_type] = []
+                getattr(self, f'_import_{record_type}')(records)
+
+    def finish(self):
+        self.flush()
+        # Plants were inserted without a species; link them to the shared catalogue in one pass
+        link_species(self.user_id)
+
+    def _insert(self, model, rows):
+        """Bulk insert one chunk and return the new ids in input order."""
+        if not rows:
+            return []
+        table = model.__table__
+        ids = db.session.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+        # Bulk inserts skip the flush events, so log them for /sync ourselves
+        record_changes(db.session, table.name, [(row_id, self.user_id) for row_id in ids], 'upsert')
+        self.imported[table.name] += len(ids)
+        return ids
+
+    def _import_plant(self, records):
+        rows = [
+            {'name': r['name'], 'img_url': r.get('img_url'), 'description': r.get('description'), 'user_id': self.user_id}
+            for r in records
+        ]
+        for record, new_id in zip(records, self._insert(Plant, rows)):
+            if record.get('id') is not None:
+                self.plant_ids[record['id']] = new_id
+
+    def _import_care_schedule(self, records):
+        rows = []
+        for r in records:
+            plant_id = self.plant_ids.get(r.get('plant_id'))
+            if plant_id is None:
+                self.skipped += 1
+                continue
+            rows.append({
+                'task': r['task'],
+                'schedule_date': datetime.strptime(r['schedule_date'][:10], '%Y-%m-%d').date(),
+                'interval': r.get('interval'),
+                'plant_id': plant_id,
+                'user_id': self.user_id
+            })
+        self._insert(CareSchedule, rows)
+
+    def _import_layout(self, records):
+        rows = []
+        for r in records:
+            layout_data = r['layout_data']
+            if isinstance(layout_data, str):
+                layout_data = json.loads(layout_data)
+            for item in layout_data:
+                if isinstance(item, dict) and item.get('plant_id') in self.plant_ids:
+                    item['plant_id'] = self.plant_ids[item['plant_id']]
+            rows.append({
+                'name': r['name'],
+                'layout_data': json.dumps(layout_data),
+                'user_id': self.user_id,
+                'created_at': _parse_datetime(r.get('created_at')),
+                'updated_at': _parse_datetime(r.get('updated_at'))
+            })
+        self._insert(Layout, rows)
+
+    def _import_tip(self, records):
+        rows = [
+            {'title': r['title'], 'content': r['content'], 'user_id': self.user_id, 'created_at': _parse_datetime(r.get('created_at'))}
+            for r in records
+        ]
+        self._insert(Tip, rows)
+
+    def progress(self):
+        return {'imported': self.imported, 'skipped': self.skipped}
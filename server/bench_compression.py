@@ -0,0 +1,118 @@
+"""Bytes on the wire and CPU per request for the JSON endpoints, per Accept-Encoding.
+
+Runs against a throwaway SQLite database filled with synthetic data:
+
+    python bench_compression.py --users 20 --posts 500 --requests 50
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import date
+
+ENDPOINTS = ['/forum_posts', '/layouts', '/tips', '/plants', '/care_schedules', '/sync']
+
+
+def seed(db, models, users, posts):
+    from flask import current_app
+    from models import fill_comment_paths
+    User, Plant, CareSchedule, Tip, Layout, ForumPost, Comment = models
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x'} for i in range(1, users + 1)
+    ])
+    db.session.execute(Plant.__table__.insert(), [
+        {'name': f'Plant {i}', 'img_url': f'https://images.example.com/plants/{i}.jpg',
+         'description': 'A hardy plant that enjoys full sun and well-drained soil. ' * 4, 'user_id': 1}
+        for i in range(1, 101)
+    ])
+    db.session.execute(CareSchedule.__table__.insert(), [
+        {'task': 'Watering', 'schedule_date': date(2024, 8, 1), 'interval': 'Daily', 'plant_id': i, 'user_id': 1}
+        for i in range(1, 101)
+    ])
+    db.session.execute(Layout.__table__.insert(), [
+        {'name': f'Bed {i}', 'user_id': 1, 'layout_data': json.dumps([
+            {'plant_id': p, 'name': f'Plant {p}', 'img_url': f'https://images.example.com/plants/{p}.jpg',
+             'position': {'x': p % 10, 'y': p // 10}} for p in range(1, 101)
+        ])}
+        for i in range(10)
+    ])
+    db.session.execute(Tip.__table__.insert(), [
+        {'title': f'Tip {i}', 'content': 'Water deeply but infrequently to encourage deep roots. ' * 5,
+         'user_id': i % users + 1}
+        for i in range(200)
+    ])
+    db.session.execute(ForumPost.__table__.insert(), [
+        {'title': f'Question {i} about tomatoes', 'content': 'My tomato leaves are turning yellow, what should I do? ' * 3,
+         'user_id': i % users + 1}
+        for i in range(posts)
+    ])
+    db.session.execute(Comment.__table__.insert(), [
+        {'content': 'Check for overwatering and add some compost.', 'user_id': i % users + 1, 'post_id': i % posts + 1}
+        for i in range(posts * 3)
+    ])
+    fill_comment_paths()
+    # The Core inserts above skip the ranking hooks, so counts and scores are redone in one pass per batch
+    ranking = current_app.extensions['forum_ranking']
+    for start in range(1, posts + 1, 1000):
+        ranking.refresh_activity(list(range(start, min(start + 1000, posts + 1))))
+    db.session.commit()
+
+
+def measure(client, headers, path, encoding, requests):
+    request_headers = dict(headers, **{'Accept-Encoding': encoding})
+    sizes = []
+    start = time.process_time()
+    for _ in range(requests):
+        response = client.get(path, headers=request_headers)
+        sizes.append(len(response.get_data()))
+    cpu_ms = (time.process_time() - start) * 1000 / requests
+    return sizes[0], cpu_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+
+    import app as app_module
+    from flask_jwt_extended import create_access_token
+    from models import db, User, Plant, CareSchedule, Tip, Layout, ForumPost, Comment
+    from compression import CompressedCache, brotli
+
+    app = app_module.app
+    app.config['JWT_TOKEN_LOCATION'] = ['headers']
+    app.config['RATELIMIT_ENABLED'] = False
+
+    with app.app_context():
+        db.create_all()
+        seed(db, (User, Plant, CareSchedule, Tip, Layout, ForumPost, Comment), args.users, args.posts)
+        headers = {'Authorization': f'Bearer {create_access_token(identity=1)}'}
+
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+    client = app.test_client()
+
+    def report(title):
+        print(title)
+        print(f'{"endpoint":<18}{"encoding":<10}{"bytes":>10}{"ratio":>8}{"cpu ms/req":>12}')
+        for path in ENDPOINTS:
+            baseline = None
+            for encoding in encodings:
+                size, cpu_ms = measure(client, headers, path, encoding, args.requests)
+                baseline = baseline or size
+                print(f'{path:<18}{encoding:<10}{size:>10}{size / baseline:>8.2f}{cpu_ms:>12.2f}')
+        print()
+
+    report('with compressed-body cache:')
+    # A zero-byte cache stores nothing, so every request pays for compression
+    app_module.compressor.cache = CompressedCache(0)
+    report('without compressed-body cache:')
+
+
+if __name__ == '__main__':
+    main()
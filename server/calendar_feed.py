@@ -0,0 +1,156 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from flask import Response, request, stream_with_context
+from models import db, ChangeLog, CareSchedule, Plant
+from compression import etag_variants
+
+# Care schedule intervals as offered by the client, mapped to recurrence rules
+RRULES = {
+    'daily': 'FREQ=DAILY',
+    'weekly': 'FREQ=WEEKLY',
+    'fortnightly': 'FREQ=WEEKLY;INTERVAL=2',
+    'monthly': 'FREQ=MONTHLY',
+}
+# Feeds change only when these tables do
+FEED_TABLES = ('care_schedule', 'plant')
+CHUNK_SIZE = 500
+
+
+def escape_text(value):
+    return (
+        value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def content_line(line):
+    """Fold a content line to 75 octets per physical line, as RFC 5545 asks, and terminate it."""
+    data = line.encode()
+    if len(data) <= 75:
+        return line + '\r\n'
+    parts = []
+    while len(data) > 75:
+        cut = 75 if not parts else 74  # Continuation lines start with a space
+        while cut and (data[cut] & 0xC0) == 0x80:  # Never split a UTF-8 sequence
+            cut -= 1
+        parts.append(data[:cut].decode())
+        data = data[cut:]
+    parts.append(data.decode())
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def event_lines(schedule_id, task, schedule_date, interval, plant_name, version, stamp):
+    lines = [
+        'BEGIN:VEVENT',
+        f'UID:care-schedule-{schedule_id}@greenthumb',
+        f'DTSTAMP:{stamp}',
+        f'DTSTART;VALUE=DATE:{schedule_date:%Y%m%d}',
+        f'SUMMARY:{escape_text(f"{task}: {plant_name}")}',
+        f'SEQUENCE:{version - 1}',  # Lets calendar apps replace an edited event instead of duplicating it
+    ]
+    rrule = RRULES.get((interval or '').strip().lower())
+    if rrule:
+        lines.append(f'RRULE:{rrule}')
+    lines.append('END:VEVENT')
+    return ''.join(content_line(line) for line in lines)
+
+
+def calendar_chunks(user_id):
+    """Yield the user's iCalendar feed, one recurring event per care schedule."""
+    stamp = f'{datetime.utcnow():%Y%m%dT%H%M%SZ}'
+    yield ''.join(content_line(line) for line in (
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//GreenThumb//Care schedules//EN',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:GreenThumb care schedule',
+    ))
+    rows = db.session.execute(
+        db.select(CareSchedule.id, CareSchedule.task, CareSchedule.schedule_date, CareSchedule.interval, Plant.name, CareSchedule.version)
+        .join(Plant, Plant.id == CareSchedule.plant_id)
+        .where(CareSchedule.user_id == user_id)
+        .order_by(CareSchedule.id)
+        .execution_options(yield_per=CHUNK_SIZE)
+    )
+    for partition in rows.partitions():
+        yield ''.join(event_lines(*row, stamp) for row in partition)
+    yield content_line('END:VCALENDAR')
+
+
+def feed_stamp(user_id):
+    """Id of the user's latest plant or care schedule change; a new value means the feed changed."""
+    return db.session.execute(
+        db.select(ChangeLog.id)
+        .where(ChangeLog.user_id == user_id, ChangeLog.table_name.in_(FEED_TABLES))
+        .order_by(ChangeLog.id.desc())
+        .limit(1)
+    ).scalar() or 0
+
+
+class CalendarFeed:
+    """Serves per-user iCalendar feeds, caching each generated body.
+
+    A cached body is tagged with the feed stamp it was built from, so a write
+    made through another worker is noticed on the next poll. Routes that
+    change schedules also call invalidate() to drop the entry right away.
+    Calendar apps revalidating with If-None-Match get a 304 without the feed
+    being rebuilt or even read from the cache.
+    """
+
+    def __init__(self, app=None):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CALENDAR_CACHE_ENTRIES', 1000)
+        self.app = app
+
+    def _get(self, user_id, stamp):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] != stamp:
+                return None
+            self.entries.move_to_end(user_id)
+            return entry[1]
+
+    def _put(self, user_id, stamp, body):
+        with self.lock:
+            self.entries[user_id] = (stamp, body)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.app.config['CALENDAR_CACHE_ENTRIES']:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def response(self, user_id):
+        stamp = feed_stamp(user_id)
+        etag = f'cal-{user_id}-{stamp}'
+        headers = {'Content-Disposition': 'inline; filename=greenthumb-care.ics', 'Cache-Control': 'private, no-cache'}
+
+        # Compressed feeds carry the tag with the encoding appended
+        matched = next((tag for tag in etag_variants(etag) if request.if_none_match.contains_weak(tag)), None)
+        if matched is not None:
+            response = Response(status=304, headers=headers)
+            response.set_etag(matched, weak=True)
+            return response
+
+        body = self._get(user_id, stamp)
+        if body is not None:
+            response = Response(body, mimetype='text/calendar', headers=headers)
+        else:
+            response = Response(stream_with_context(self._generate(user_id, stamp)), mimetype='text/calendar', headers=headers)
+        response.set_etag(etag, weak=True)
+        return response
+
+    def _generate(self, user_id, stamp):
+        # Stream to the client and keep a copy; a feed is cached only once it was built completely
+        chunks = []
+        for chunk in calendar_chunks(user_id):
+            chunks.append(chunk)
+            yield chunk
+        self._put(user_id, stamp, ''.join(chunks).encode())
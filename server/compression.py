@@ -0,0 +1,190 @@
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; without it only gzip is offered
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'image/svg+xml',
+    'text/calendar',
+    'text/css',
+    'text/html',
+    'text/plain',
+}
+
+
+def encoded_etag(etag, encoding):
+    return f'{etag}-{encoding}'
+
+
+def etag_variants(etag):
+    """A route's ETag and the forms the Compressor may send it in, for the route's own If-None-Match check."""
+    return [etag] + [encoded_etag(etag, encoding) for encoding in ('br', 'gzip')]
+
+
+def gzip_compress(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        # Sync-flush each chunk so the client can start decoding before the stream ends
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def brotli_compress(data, level):
+    return brotli.compress(data, quality=min(level, 11))
+
+
+def brotli_stream(chunks, level):
+    compressor = brotli.Compressor(quality=min(level, 11))
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+class CompressedCache:
+    """LRU of compressed bodies keyed by ETag, bounded by total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.entries.get(key)
+            if data is not None:
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class Compressor:
+    """Compresses responses with gzip or brotli according to Accept-Encoding.
+
+    Bodies smaller than COMPRESS_MIN_SIZE are sent as-is. GET responses get an
+    ETag for their encoded form, and the compressed bytes are cached under it,
+    so an unchanged payload is only compressed once. An ETag the route set is
+    kept with the encoding appended; only responses without one have their
+    body hashed. Streamed responses are compressed chunk by chunk.
+    """
+
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_CACHE_BYTES', 16 * 1024 * 1024)
+        self.app = app
+        self.cache = CompressedCache(app.config['COMPRESS_CACHE_BYTES'])
+        app.after_request(self._after_request)
+
+    def encodings(self):
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def negotiate(self):
+        return request.accept_encodings.best_match(self.encodings())
+
+    def _compressible(self, response):
+        return (
+            self.app.config['COMPRESS_ENABLED']
+            and 200 <= response.status_code < 300
+            and response.status_code != 204
+            and 'Content-Encoding' not in response.headers
+            and response.mimetype in COMPRESSIBLE_MIMETYPES
+            and not response.direct_passthrough
+        )
+
+    def _after_request(self, response):
+        if not self._compressible(response):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+
+        level = self.app.config['COMPRESS_LEVEL']
+        route_etag, weak = response.get_etag()
+        if response.is_streamed:
+            stream = brotli_stream if encoding == 'br' else gzip_stream
+            response.response = stream(response.response, level)
+            response.headers['Content-Encoding'] = encoding
+            response.headers.pop('Content-Length', None)
+            if route_etag:
+                response.set_etag(encoded_etag(route_etag, encoding), weak=weak)
+            return response
+
+        data = response.get_data()
+        if len(data) < self.app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        response.headers['Content-Encoding'] = encoding
+        cacheable = request.method in ('GET', 'HEAD') and response.status_code == 200
+        if not cacheable:
+            response.set_data(self._compress(data, encoding, level))
+            return response
+
+        # The encoding is part of the tag because the gzip and brotli bodies are different representations
+        if route_etag:
+            etag = encoded_etag(route_etag, encoding)
+            cache_key = (request.path, etag)  # Route tags are only unique per route
+        else:
+            # Hashing the body is far cheaper than compressing it
+            etag = encoded_etag(hashlib.sha1(data).hexdigest(), encoding)
+            weak = False
+            cache_key = etag
+        response.set_etag(etag, weak=weak)
+        if request.if_none_match.contains_weak(etag) if weak else request.if_none_match.contains(etag):
+            response.status_code = 304
+            response.set_data(b'')
+            response.headers.pop('Content-Encoding', None)
+            return response
+
+        compressed = self.cache.get(cache_key)
+        if compressed is None:
+            compressed = self._compress(data, encoding, level)
+            self.cache.put(cache_key, compressed)
+        response.set_data(compressed)
+        return response
+
+    def _compress(self, data, encoding, level):
+        if encoding == 'br':
+            return brotli_compress(data, level)
+        return gzip_compress(data, level)
@@ -0,0 +1,54 @@
+from flask import abort, jsonify, request
+from sqlalchemy import select, update
+from models import db, record_changes
+
+
+def expected_versions():
+    """Versions the client says it last read, from If-Match, or None for an unconditional write."""
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    try:
+        return {int(tag) for tag in request.if_match.as_set(include_weak=True)}
+    except ValueError:
+        abort(400, description='If-Match must carry a version ETag')
+
+
+def versioned_update(model, row_id, user_id, versions, values, returning=()):
+    """Apply `values` to one owned row with a single UPDATE ... WHERE id AND version.
+
+    `versions` comes from expected_versions(); None skips the version check.
+    The version is bumped in the same statement and read back with RETURNING,
+    together with any extra `returning` columns. Returns (row, None) on
+    success, or (current, status) with status 404, 403 or 409 when nothing
+    matched; only then is the row read again, to tell the cases apart.
+    """
+    statement = update(model).where(model.id == row_id, model.user_id == user_id)
+    if versions is not None:
+        statement = statement.where(model.version.in_(versions))
+    row = db.session.execute(
+        statement.values(version=model.version + 1, **values)
+        .returning(model.version, *returning)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if row is not None:
+        # Bulk UPDATEs skip the flush events, so log the change for /sync ourselves
+        record_changes(db.session, model.__tablename__, [(row_id, user_id)], 'upsert')
+        return row, None
+
+    current = db.session.execute(select(model.user_id, model.version).where(model.id == row_id)).first()
+    if current is None:
+        return None, 404
+    if current.user_id != user_id:
+        return current, 403
+    return current, 409
+
+
+def version_conflict(current_version):
+    response = jsonify({'error': 'This item was changed by someone else; reload and try again', 'version': current_version})
+    response.status_code = 409
+    response.set_etag(str(current_version))
+    return response
+
+
+def version_etag(version):
+    return {'ETag': f'"{version}"'}
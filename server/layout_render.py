@@ -0,0 +1,178 @@
+import glob
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from xml.sax.saxutils import escape
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+except ImportError:  # Pillow is optional; without it plans are only rendered as SVG
+    Image = None
+
+# This module must not import the app or models: render() runs in spawned worker processes
+
+TILE_SIZES = {'small': 64, 'medium': 128, 'large': 192}
+MAX_COLUMNS = 12
+MAX_PIXELS = 16 * 1024 * 1024  # Tiles shrink for very large plans so one render stays bounded
+BACKGROUND = '#1a202c'
+TILE_TEXT = '#ffffff'
+MIMETYPES = {'svg': 'image/svg+xml', 'png': 'image/png'}
+
+
+class RenderTimeout(Exception):
+    """A render did not finish within LAYOUT_RENDER_TIMEOUT."""
+
+
+def tile_color(name):
+    """A stable green-ish colour per plant name, so the same plant looks the same in every plan."""
+    digest = hashlib.md5(name.encode()).digest()
+    hue = 90 + digest[0] % 70
+    lightness = 30 + digest[1] % 20
+    return f'hsl({hue},45%,{lightness}%)'
+
+
+def plan_grid(items, columns, tile):
+    """Lay items out row by row, like the client's grid; returns (width, height, tile, cells)."""
+    items = [item for item in items if isinstance(item, dict)]
+    rows = max(math.ceil(len(items) / columns), 1)
+    tile = min(tile, int(math.sqrt(MAX_PIXELS / (columns * rows))))
+    gap = max(tile // 16, 2)
+    cells = []
+    for index, item in enumerate(items):
+        name = str(item.get('name') or f'Plant {item.get("plant_id", "")}'.strip())
+        x = gap + (index % columns) * (tile + gap)
+        y = gap + (index // columns) * (tile + gap)
+        cells.append((x, y, name, tile_color(name)))
+    return gap + columns * (tile + gap), gap + rows * (tile + gap), tile, cells
+
+
+def font_size(tile):
+    return max(tile // 8, 8)
+
+
+def _label(name, tile):
+    # Roughly what fits across 90% of the tile at 0.6em per character
+    limit = max(int(tile * 0.9 / (font_size(tile) * 0.6)), 4)
+    return name if len(name) <= limit else name[:limit - 1] + '…'
+
+
+def render_svg(items, columns, tile):
+    width, height, tile, cells = plan_grid(items, columns, tile)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}">',
+        f'<rect width="100%" height="100%" fill="{BACKGROUND}"/>',
+    ]
+    for x, y, name, color in cells:
+        parts.append(
+            f'<g><title>{escape(name)}</title>'
+            f'<rect x="{x}" y="{y}" width="{tile}" height="{tile}" rx="{tile // 12}" fill="{color}"/>'
+            f'<text x="{x + tile // 2}" y="{y + tile // 2}" fill="{TILE_TEXT}" font-family="sans-serif" '
+            f'font-size="{font_size(tile)}" text-anchor="middle" dominant-baseline="middle">{escape(_label(name, tile))}</text></g>'
+        )
+    parts.append('</svg>')
+    return ''.join(parts).encode()
+
+
+def render_png(items, columns, tile):
+    width, height, tile, cells = plan_grid(items, columns, tile)
+    image = Image.new('RGB', (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=font_size(tile))
+    except TypeError:  # Pillow < 10.1 only has the fixed-size bitmap font
+        font = ImageFont.load_default()
+    for x, y, name, color in cells:
+        draw.rounded_rectangle((x, y, x + tile, y + tile), radius=tile // 12, fill=color)
+        draw.text((x + tile // 2, y + tile // 2), _label(name, tile), fill=TILE_TEXT, font=font, anchor='mm')
+    output = io.BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+def render(fmt, items, columns, tile):
+    if fmt == 'png':
+        return render_png(items, columns, tile)
+    return render_svg(items, columns, tile)
+
+
+class LayoutRenderer:
+    """Renders garden plans in a process pool and keeps the results on disk.
+
+    Files are named after (user id, layout id, updated_at, size, columns), so
+    an edited layout simply misses the cache, and a repeat view is a file
+    send. The user id is part of the name because layout ids are only unique
+    within a shard. Workers
+    are spawned rather than forked so they never inherit database connections
+    or threads from the request worker.
+    """
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LAYOUT_RENDER_PROCESSES', 2)
+        app.config.setdefault('LAYOUT_RENDER_TIMEOUT', 30)
+        app.config.setdefault('LAYOUT_RENDER_DIR', os.path.join(app.instance_path, 'layout_renders'))
+        self.app = app
+
+    def formats(self):
+        return ['svg', 'png'] if Image is not None else ['svg']
+
+    def _pool(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.app.config['LAYOUT_RENDER_PROCESSES'],
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self.executor
+
+    def path(self, user_id, layout_id, updated_at, size, columns, fmt):
+        stamp = updated_at.strftime('%Y%m%d%H%M%S%f') if updated_at else '0'
+        return os.path.join(self.app.config['LAYOUT_RENDER_DIR'], f'{user_id}-{layout_id}-{stamp}-{size}-{columns}.{fmt}')
+
+    def cached(self, user_id, layout_id, updated_at, size, columns, fmt):
+        path = self.path(user_id, layout_id, updated_at, size, columns, fmt)
+        return path if os.path.exists(path) else None
+
+    def render(self, user_id, layout_id, updated_at, items, size, columns, fmt):
+        """Render in the pool, store atomically and return the file path; raises RenderTimeout."""
+        path = self.path(user_id, layout_id, updated_at, size, columns, fmt)
+        future = self._pool().submit(render, fmt, items, columns, TILE_SIZES[size])
+        try:
+            data = future.result(timeout=self.app.config['LAYOUT_RENDER_TIMEOUT'])
+        except FutureTimeoutError:
+            # Drops it if still queued; a render already running finishes in its worker, bounded by MAX_PIXELS
+            future.cancel()
+            raise RenderTimeout(f'Rendering layout {layout_id} took over {self.app.config["LAYOUT_RENDER_TIMEOUT"]}s') from None
+        except BrokenProcessPool:
+            with self.lock:
+                self.executor = None  # A worker died; start a fresh pool next time
+            raise
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._discard_stale(user_id, layout_id, os.path.basename(path).split('-')[2])
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return path
+
+    def _discard_stale(self, user_id, layout_id, stamp=None):
+        for path in glob.glob(os.path.join(self.app.config['LAYOUT_RENDER_DIR'], f'{user_id}-{layout_id}-*')):
+            if stamp is None or os.path.basename(path).split('-')[2] != stamp:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def discard(self, user_id, layout_id):
+        self._discard_stale(user_id, layout_id)
@@ -0,0 +1,251 @@
+import fcntl
+import glob
+import hmac
+import json
+import mmap
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from flask import g, request
+
+KB = 1024
+MB = 1024 * 1024
+RETIRED = 'retired.json'  # Totals of workers that have exited, next to the live workers' {pid}.json
+
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * mmap.PAGESIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(path, data):
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def _add_routes(totals, routes):
+    for endpoint, stats in routes.items():
+        total = totals.setdefault(endpoint, {'requests': 0, 'peak_max': 0, 'peak_total': 0, 'rss_growth': 0})
+        total['requests'] += stats['requests']
+        total['peak_max'] = max(total['peak_max'], stats['peak_max'])
+        total['peak_total'] += stats['peak_total']
+        total['rss_growth'] += stats['rss_growth']
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class MemoryGuard:
+    """Per-route memory tracking and RSS-bounded workers, both opt-in.
+
+    With MEMORY_TRACKING on, every request is traced with tracemalloc and its
+    peak allocation and RSS growth are added up per endpoint, including
+    streamed bodies, since the numbers are taken at request teardown. Each
+    worker writes its totals to MEMORY_STATS_DIR, so GET /admin/memory can
+    report the heaviest routes across all workers, recycled ones included:
+    reports fold the files of exited workers into one of retired totals.
+    tracemalloc peaks are process-wide, so they are exact with sync workers
+    and an upper bound with threaded ones. Tracing costs CPU; turn it on to
+    measure, not permanently.
+
+    With MEMORY_RSS_LIMIT_MB set, a gunicorn worker whose RSS has crossed the
+    limit after a request sends itself SIGTERM. Gunicorn then stops giving it
+    new connections, lets in-flight requests finish within its graceful
+    timeout and starts a fresh worker in its place. The drain is clean with
+    sync workers (gunicorn's default); gthread workers can drop a connection
+    accepted in their last second, as they also do for max_requests.
+    """
+
+    def __init__(self, app=None):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.flushed_at = 0
+        self.recycling = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MEMORY_TRACKING', False)
+        app.config.setdefault('MEMORY_TRACE_FRAMES', 1)
+        app.config.setdefault('MEMORY_RSS_LIMIT_MB', None)
+        app.config.setdefault('MEMORY_STATS_DIR', os.path.join(app.instance_path, 'memory_stats'))
+        app.config.setdefault('MEMORY_STATS_FLUSH_SECONDS', 30)
+        app.config.setdefault('MEMORY_ADMIN_TOKEN', None)  # Sent as X-Admin-Token; /admin/memory is a 404 without it
+        self.app = app
+        app.extensions['memory_guard'] = self
+        if not app.config['MEMORY_TRACKING'] and not app.config['MEMORY_RSS_LIMIT_MB']:
+            return
+
+        if app.config['MEMORY_TRACKING'] and not tracemalloc.is_tracing():
+            tracemalloc.start(app.config['MEMORY_TRACE_FRAMES'])
+        if app.config['MEMORY_RSS_LIMIT_MB'] and current_rss() is None:
+            app.logger.warning('MEMORY_RSS_LIMIT_MB is set but RSS cannot be read on this platform; workers will not be recycled')
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    @property
+    def tracking(self):
+        return self.app.config['MEMORY_TRACKING']
+
+    def _over_limit(self, rss):
+        limit = self.app.config['MEMORY_RSS_LIMIT_MB']
+        return bool(limit) and rss is not None and rss > limit * MB
+
+    def _before_request(self):
+        g.memory_rss = current_rss()
+        if self.tracking:
+            tracemalloc.reset_peak()
+            g.memory_traced = tracemalloc.get_traced_memory()[0]
+
+    def _after_request(self, response):
+        if self._over_limit(current_rss()):
+            response.headers['Connection'] = 'close'  # Send keep-alive clients to another worker
+        return response
+
+    def _teardown_request(self, exc):
+        rss_before = g.pop('memory_rss', None)
+        traced_before = g.pop('memory_traced', None)
+        rss = current_rss()
+        if self.tracking:
+            endpoint = request.endpoint or 'unknown'
+            peak = tracemalloc.get_traced_memory()[1] - traced_before if traced_before is not None else 0
+            growth = rss - rss_before if rss is not None and rss_before is not None else 0
+            with self.lock:
+                self.requests += 1
+                stats = self.stats.setdefault(endpoint, {'requests': 0, 'peak_max': 0, 'peak_total': 0, 'rss_growth': 0})
+                stats['requests'] += 1
+                stats['peak_max'] = max(stats['peak_max'], peak)
+                stats['peak_total'] += peak
+                stats['rss_growth'] += max(growth, 0)
+            if time.monotonic() - self.flushed_at > self.app.config['MEMORY_STATS_FLUSH_SECONDS']:
+                self.flush()
+        if self._over_limit(rss) and not self.recycling:
+            self._recycle(rss)
+
+    def _recycle(self, rss):
+        if not request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+            self.app.logger.warning('RSS %.0f MB is over MEMORY_RSS_LIMIT_MB, but only gunicorn workers are recycled', rss / MB)
+            self.recycling = True  # Warn once
+            return
+        self.recycling = True
+        self.app.logger.warning('Worker %d RSS %.0f MB is over MEMORY_RSS_LIMIT_MB; recycling it', os.getpid(), rss / MB)
+        if self.tracking:
+            self.flush()
+        # Gunicorn treats SIGTERM as a graceful stop: requests in flight finish, then the master forks a new worker
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def flush(self):
+        """Write this worker's totals to MEMORY_STATS_DIR, replacing its previous file."""
+        with self.lock:
+            data = {
+                'pid': os.getpid(),
+                'rss': current_rss(),
+                'requests': self.requests,
+                'updated_at': time.time(),
+                'routes': {endpoint: dict(stats) for endpoint, stats in self.stats.items()},
+            }
+            self.flushed_at = time.monotonic()
+        directory = self.app.config['MEMORY_STATS_DIR']
+        os.makedirs(directory, exist_ok=True)
+        _write_json(os.path.join(directory, f'{os.getpid()}.json'), data)
+
+    def admin_authorized(self):
+        token = self.app.config['MEMORY_ADMIN_TOKEN']
+        return bool(token) and hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), token.encode())
+
+    def _retire_exited_workers(self, directory):
+        """Add the files of workers that are gone to the retired totals and delete them."""
+        exited = [
+            path for path in glob.glob(os.path.join(directory, '[0-9]*.json'))
+            if not _pid_alive(int(os.path.basename(path).split('.')[0]))
+        ]
+        if not exited:
+            return
+        retired_path = os.path.join(directory, RETIRED)
+        with open(os.path.join(directory, 'retired.lock'), 'w') as lock:
+            # Workers report concurrently; the lock keeps each file from being counted twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                retired = _read_json(retired_path)
+            except (OSError, ValueError):
+                retired = {'workers': 0, 'requests': 0, 'routes': {}}
+            folded = []
+            for path in exited:
+                try:
+                    data = _read_json(path)
+                except (OSError, ValueError):
+                    continue  # Already retired by another worker
+                retired['workers'] += 1
+                retired['requests'] += data['requests']
+                _add_routes(retired['routes'], data['routes'])
+                folded.append(path)
+            if folded:
+                _write_json(retired_path, retired)
+            for path in folded:
+                os.remove(path)
+
+    def report(self, limit):
+        """Every worker's RSS and the `limit` routes with the highest peak allocation, across all workers."""
+        if self.tracking:
+            self.flush()
+        directory = self.app.config['MEMORY_STATS_DIR']
+        if os.path.isdir(directory):
+            self._retire_exited_workers(directory)
+        workers = []
+        routes = {}
+        for path in glob.glob(os.path.join(directory, '[0-9]*.json')):
+            try:
+                data = _read_json(path)
+            except (OSError, ValueError):
+                continue  # Being replaced or retired right now
+            workers.append({
+                'pid': data['pid'],
+                'rss_mb': round(data['rss'] / MB, 1) if data['rss'] is not None else None,
+                'requests': data['requests'],
+                'updated_at': data['updated_at'],
+            })
+            _add_routes(routes, data['routes'])
+        try:
+            retired = _read_json(os.path.join(directory, RETIRED))
+        except (OSError, ValueError):
+            retired = {'workers': 0, 'requests': 0, 'routes': {}}
+        _add_routes(routes, retired['routes'])
+
+        ranked = sorted(routes.items(), key=lambda item: (item[1]['peak_max'], item[1]['rss_growth']), reverse=True)
+        return {
+            'tracking': self.tracking,
+            'rss_limit_mb': self.app.config['MEMORY_RSS_LIMIT_MB'],
+            'workers': sorted(workers, key=lambda worker: worker['pid']),
+            'retired_workers': {'count': retired['workers'], 'requests': retired['requests']},
+            'routes': [
+                {
+                    'endpoint': endpoint,
+                    'requests': stats['requests'],
+                    'peak_max_kb': round(stats['peak_max'] / KB, 1),
+                    'peak_mean_kb': round(stats['peak_total'] / stats['requests'] / KB, 1),
+                    'rss_growth_kb': round(stats['rss_growth'] / KB, 1),
+                }
+                for endpoint, stats in ranked[:limit]
+            ],
+        }
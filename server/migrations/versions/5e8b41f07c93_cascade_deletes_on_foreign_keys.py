@@ -0,0 +1,53 @@
+"""Add ON DELETE CASCADE to foreign keys
+
+Revision ID: 5e8b41f07c93
+Revises: 3c1d9a7e5b20
+Create Date: 2026-10-19 11:40:07.218846
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e8b41f07c93'
+down_revision = '3c1d9a7e5b20'
+branch_labels = None
+depends_on = None
+
+# The initial migration created unnamed foreign keys; this convention gives the
+# reflected constraints names so batch mode can drop and recreate them.
+naming_convention = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s',
+}
+
+# (table, column, referred table)
+foreign_keys = [
+    ('plant', 'user_id', 'user'),
+    ('tip', 'user_id', 'user'),
+    ('layout', 'user_id', 'user'),
+    ('forum_post', 'user_id', 'user'),
+    ('care_schedule', 'plant_id', 'plant'),
+    ('care_schedule', 'user_id', 'user'),
+    ('comment', 'post_id', 'forum_post'),
+    ('comment', 'user_id', 'user'),
+]
+
+
+def _recreate_foreign_keys(ondelete):
+    for table in dict.fromkeys(table for table, _, _ in foreign_keys):
+        with op.batch_alter_table(table, schema=None, naming_convention=naming_convention) as batch_op:
+            for fk_table, column, referred in foreign_keys:
+                if fk_table != table:
+                    continue
+                name = f'fk_{table}_{column}_{referred}'
+                batch_op.drop_constraint(name, type_='foreignkey')
+                batch_op.create_foreign_key(name, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _recreate_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _recreate_foreign_keys(None)
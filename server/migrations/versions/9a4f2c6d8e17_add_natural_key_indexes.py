@@ -0,0 +1,34 @@
+"""Add indexes on natural keys used by seeding and per-user lookups
+
+Revision ID: 9a4f2c6d8e17
+Revises: 5e8b41f07c93
+Create Date: 2026-10-19 13:05:52.640381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4f2c6d8e17'
+down_revision = '5e8b41f07c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_plant_user_id_name', 'plant', ['user_id', 'name'], unique=False)
+    op.create_index('ix_care_schedule_plant_id_task', 'care_schedule', ['plant_id', 'task'], unique=False)
+    op.create_index('ix_tip_user_id_title', 'tip', ['user_id', 'title'], unique=False)
+    op.create_index('ix_forum_post_user_id_title', 'forum_post', ['user_id', 'title'], unique=False)
+    op.create_index('ix_comment_post_id', 'comment', ['post_id'], unique=False)
+    op.create_index('ix_layout_user_id_name', 'layout', ['user_id', 'name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_layout_user_id_name', table_name='layout')
+    op.drop_index('ix_comment_post_id', table_name='comment')
+    op.drop_index('ix_forum_post_user_id_title', table_name='forum_post')
+    op.drop_index('ix_tip_user_id_title', table_name='tip')
+    op.drop_index('ix_care_schedule_plant_id_task', table_name='care_schedule')
+    op.drop_index('ix_plant_user_id_name', table_name='plant')
@@ -0,0 +1,36 @@
+"""Add weather grid cells to users and a per-cell forecast cache
+
+Revision ID: a6e4c8d21f73
+Revises: f3d9b6e21a58
+Create Date: 2026-10-19 22:05:41.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6e4c8d21f73'
+down_revision = 'f3d9b6e21a58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('weather_forecast',
+    sa.Column('cell', sa.String(length=32), nullable=False),
+    sa.Column('fetched_at', sa.DateTime(), nullable=False),
+    sa.Column('days', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('cell')
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('weather_cell', sa.String(length=32), nullable=True))
+        batch_op.create_index(batch_op.f('ix_user_weather_cell'), ['weather_cell'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_weather_cell'))
+        batch_op.drop_column('weather_cell')
+
+    op.drop_table('weather_forecast')
@@ -0,0 +1,65 @@
+"""Add species catalogue and link plants to it
+
+Revision ID: b7d3e5a1c924
+Revises: 9a4f2c6d8e17
+Create Date: 2026-10-19 14:22:31.905117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3e5a1c924'
+down_revision = '9a4f2c6d8e17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('species',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('normalized_name', sa.String(length=64), nullable=False),
+    sa.Column('description', sa.String(length=500), nullable=True),
+    sa.Column('img_url', sa.String(length=255), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('normalized_name')
+    )
+    with op.batch_alter_table('plant', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('species_id', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_plant_species_id'), ['species_id'], unique=False)
+        batch_op.create_foreign_key('fk_plant_species_id_species', 'species', ['species_id'], ['id'])
+
+    # One species per distinct plant name, seeded from the existing plant rows
+    op.execute("""
+        INSERT INTO species (name, normalized_name, description, img_url)
+        SELECT min(trim(name)), lower(trim(name)), min(description), min(img_url)
+        FROM plant GROUP BY lower(trim(name))
+    """)
+    op.execute("""
+        UPDATE plant SET species_id = (
+            SELECT species.id FROM species WHERE species.normalized_name = lower(trim(plant.name))
+        )
+    """)
+    # Plants keep only the values that differ from their species
+    for column in ('description', 'img_url'):
+        op.execute(f"""
+            UPDATE plant SET {column} = NULL
+            WHERE {column} = (SELECT species.{column} FROM species WHERE species.id = plant.species_id)
+        """)
+
+
+def downgrade():
+    for column in ('description', 'img_url'):
+        op.execute(f"""
+            UPDATE plant SET {column} = (SELECT species.{column} FROM species WHERE species.id = plant.species_id)
+            WHERE {column} IS NULL
+        """)
+
+    with op.batch_alter_table('plant', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_plant_species_id_species', type_='foreignkey')
+        batch_op.drop_index(batch_op.f('ix_plant_species_id'))
+        batch_op.drop_column('species_id')
+
+    op.drop_table('species')
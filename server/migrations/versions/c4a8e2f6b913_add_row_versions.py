@@ -0,0 +1,30 @@
+"""Add version columns for optimistic concurrency
+
+Revision ID: c4a8e2f6b913
+Revises: b7d3e5a1c924
+Create Date: 2026-10-19 16:05:12.418733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e2f6b913'
+down_revision = 'b7d3e5a1c924'
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ['plant', 'care_schedule', 'tip', 'forum_post', 'comment', 'layout']
+
+
+def upgrade():
+    for table_name in VERSIONED_TABLES:
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    for table_name in reversed(VERSIONED_TABLES):
+        with op.batch_alter_table(table_name, schema=None) as batch_op:
+            batch_op.drop_column('version')
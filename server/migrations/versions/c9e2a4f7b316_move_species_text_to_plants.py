@@ -0,0 +1,33 @@
+"""Move user-entered species descriptions and images back onto the plants
+
+Revision ID: c9e2a4f7b316
+Revises: a6e4c8d21f73
+Create Date: 2026-10-19 23:48:12.604391
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9e2a4f7b316'
+down_revision = 'a6e4c8d21f73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Species rows were seeded from whichever plant came first, so their text is
+    # some user's own. Give every plant that relied on it an explicit copy, then
+    # clear the catalogue so it only ever shows curated values.
+    for column in ('description', 'img_url'):
+        op.execute(f"""
+            UPDATE plant SET {column} = (SELECT species.{column} FROM species WHERE species.id = plant.species_id)
+            WHERE {column} IS NULL AND species_id IS NOT NULL
+        """)
+    op.execute("UPDATE species SET description = NULL, img_url = NULL")
+
+
+def downgrade():
+    # The plants already carry the values; the old catalogue text is not restored
+    pass
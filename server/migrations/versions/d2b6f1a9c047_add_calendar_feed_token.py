@@ -0,0 +1,28 @@
+"""Add calendar feed token to users
+
+Revision ID: d2b6f1a9c047
+Revises: c4a8e2f6b913
+Create Date: 2026-10-19 17:41:03.276518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2b6f1a9c047'
+down_revision = 'c4a8e2f6b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('calendar_token_hash', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_user_calendar_token_hash', ['calendar_token_hash'])
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_user_calendar_token_hash', type_='unique')
+        batch_op.drop_column('calendar_token_hash')
@@ -0,0 +1,66 @@
+"""Add hot score, comment count and last activity to forum posts
+
+Revision ID: e7c3a5d80b42
+Revises: d2b6f1a9c047
+Create Date: 2026-10-19 19:12:46.530981
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c3a5d80b42'
+down_revision = 'd2b6f1a9c047'
+branch_labels = None
+depends_on = None
+
+HALF_LIFE_HOURS = 24  # Default FORUM_HOT_HALF_LIFE_HOURS
+
+
+def _decayed(since, now):
+    if since is None:
+        return 0.0
+    if isinstance(since, str):
+        since = datetime.fromisoformat(since)
+    age_hours = max((now - since).total_seconds() / 3600, 0)
+    return 0.5 ** (age_hours / HALF_LIFE_HOURS)
+
+
+def upgrade():
+    with op.batch_alter_table('forum_post', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hot_score', sa.Float(), server_default='1', nullable=False))
+        batch_op.add_column(sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('last_activity_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_forum_post_created_at'), ['created_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_forum_post_hot_score'), ['hot_score'], unique=False)
+        batch_op.create_index(batch_op.f('ix_forum_post_last_activity_at'), ['last_activity_at'], unique=False)
+
+    # Counts and last activity are set-based; scores are replayed from each post's comment dates
+    op.execute(
+        'UPDATE forum_post SET '
+        'comment_count = (SELECT count(*) FROM comment WHERE comment.post_id = forum_post.id), '
+        'last_activity_at = coalesce((SELECT max(date_created) FROM comment WHERE comment.post_id = forum_post.id), created_at)'
+    )
+    bind = op.get_bind()
+    now = datetime.utcnow()
+    scores = {post_id: _decayed(created_at, now) for post_id, created_at in bind.execute(sa.text('SELECT id, created_at FROM forum_post'))}
+    for post_id, date_created in bind.execute(sa.text('SELECT post_id, date_created FROM comment')):
+        if post_id in scores:
+            scores[post_id] += _decayed(date_created, now)
+    if scores:
+        bind.execute(
+            sa.text('UPDATE forum_post SET hot_score = :score WHERE id = :id'),
+            [{'id': post_id, 'score': score if score >= 0.01 else 0} for post_id, score in scores.items()]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('forum_post', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_forum_post_last_activity_at'))
+        batch_op.drop_index(batch_op.f('ix_forum_post_hot_score'))
+        batch_op.drop_index(batch_op.f('ix_forum_post_created_at'))
+        batch_op.drop_column('last_activity_at')
+        batch_op.drop_column('comment_count')
+        batch_op.drop_column('hot_score')
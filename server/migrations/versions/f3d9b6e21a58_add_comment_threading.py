@@ -0,0 +1,45 @@
+"""Add reply threading to comments with materialized paths
+
+Revision ID: f3d9b6e21a58
+Revises: e7c3a5d80b42
+Create Date: 2026-10-19 20:37:18.664209
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3d9b6e21a58'
+down_revision = 'e7c3a5d80b42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('path', sa.String(length=255), server_default='', nullable=False))
+        batch_op.create_foreign_key('fk_comment_parent_id_comment', 'comment', ['parent_id'], ['id'], ondelete='CASCADE')
+        batch_op.drop_index('ix_comment_post_id')
+        batch_op.create_index('ix_comment_post_id_path', ['post_id', 'path'], unique=False)
+        batch_op.create_index(batch_op.f('ix_comment_parent_id'), ['parent_id'], unique=False)
+
+    # Every existing comment is top-level, so its path is just its own zero-padded id
+    bind = op.get_bind()
+    ids = [row[0] for row in bind.execute(sa.text('SELECT id FROM comment'))]
+    if ids:
+        bind.execute(
+            sa.text('UPDATE comment SET path = :path WHERE id = :id'),
+            [{'id': comment_id, 'path': f'{comment_id:010d}/'} for comment_id in ids]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_comment_parent_id'))
+        batch_op.drop_index('ix_comment_post_id_path')
+        batch_op.create_index('ix_comment_post_id', ['post_id'], unique=False)
+        batch_op.drop_constraint('fk_comment_parent_id_comment', type_='foreignkey')
+        batch_op.drop_column('path')
+        batch_op.drop_column('parent_id')
@@ -1,22 +1,42 @@
 from datetime import datetime
+import hashlib
 import json
+import math
+import secrets
+import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.orm.attributes import set_committed_value
+from replicas import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores ON DELETE CASCADE unless foreign keys are switched on per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(128), nullable=False)
+    calendar_token_hash = db.Column(db.String(64), unique=True)  # SHA-256 of the secret in the user's calendar feed URL
+    weather_cell = db.Column(db.String(32), index=True)  # Forecast grid cell; the exact location is not stored
 
-    # Relationships
-    plants = db.relationship('Plant', backref='user', lazy=True)
-    tips = db.relationship('Tip', backref='user', lazy=True)
-    layouts = db.relationship('Layout', backref='user', lazy=True)
-    posts = db.relationship('ForumPost', backref='user', lazy=True)
-    comments = db.relationship('Comment', backref='user', lazy=True)
+    # Relationships; children are removed by ON DELETE CASCADE rather than loaded and deleted one by one
+    plants = db.relationship('Plant', backref='user', lazy=True, cascade='all', passive_deletes=True)
+    tips = db.relationship('Tip', backref='user', lazy=True, cascade='all', passive_deletes=True)
+    layouts = db.relationship('Layout', backref='user', lazy=True, cascade='all', passive_deletes=True)
+    posts = db.relationship('ForumPost', backref='user', lazy=True, cascade='all', passive_deletes=True)
+    comments = db.relationship('Comment', backref='user', lazy=True, cascade='all', passive_deletes=True)
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -24,24 +44,153 @@ class User(db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
-class Plant(db.Model):
+    def reset_calendar_token(self):
+        """Issue a new calendar feed token, revoking the old one, and return it; only its hash is stored."""
+        token = secrets.token_urlsafe(32)
+        self.calendar_token_hash = hash_calendar_token(token)
+        return token
+
+    @classmethod
+    def by_calendar_token(cls, token):
+        if not token:
+            return None
+        return cls.query.filter_by(calendar_token_hash=hash_calendar_token(token)).first()
+
+    def set_location(self, latitude, longitude):
+        self.weather_cell = None if latitude is None else weather_cell(latitude, longitude)
+
+def hash_calendar_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+WEATHER_GRID_DEGREES = 0.25  # About 28 km north-south; everyone in a cell shares one forecast
+
+def weather_cell(latitude, longitude):
+    return f'{math.floor(latitude / WEATHER_GRID_DEGREES)}:{math.floor(longitude / WEATHER_GRID_DEGREES)}'
+
+def weather_cell_centre(cell):
+    row, column = (int(part) for part in cell.split(':'))
+    return (row + 0.5) * WEATHER_GRID_DEGREES, (column + 0.5) * WEATHER_GRID_DEGREES
+
+def normalize_species_name(name):
+    # Kept to what SQL can reproduce with lower(trim(...)), see link_species()
+    return name.strip().lower()
+
+class Species(db.Model):
+    # Shared catalogue entry; user plants point here and only store what they override.
+    # description and img_url are curated: user-entered text stays on the user's own plant.
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
-    img_url = db.Column(db.String(255))
+    normalized_name = db.Column(db.String(64), unique=True, nullable=False)  # Unique index doubles as the prefix-search index
     description = db.Column(db.String(500))
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    care_schedules = db.relationship('CareSchedule', backref='plant', lazy=True)
+    img_url = db.Column(db.String(255))
+
+    @classmethod
+    def for_name(cls, name):
+        """The catalogue entry for `name`, inserted (without description or image) if it does not exist yet."""
+        normalized = normalize_species_name(name)
+        species = cls.query.filter_by(normalized_name=normalized).first()
+        if species is not None:
+            return species
+        try:
+            with db.session.begin_nested():
+                species = cls(name=name.strip(), normalized_name=normalized)
+                db.session.add(species)
+        except IntegrityError:
+            # Another request added the same name first; the savepoint keeps the rest of the transaction
+            species = cls.query.filter_by(normalized_name=normalized).one()
+        return species
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'img_url': self.img_url
+        }
+
+    def __repr__(self):
+        return f'<Species {self.name}>'
+
+class Plant(db.Model):
+    __table_args__ = (db.Index('ix_plant_user_id_name', 'user_id', 'name'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(64), nullable=False)
+    img_url = db.Column(db.String(255))  # Per-user override; NULL means use the species image
+    description = db.Column(db.String(500))  # Per-user override; NULL means use the species description
+    species_id = db.Column(db.Integer, db.ForeignKey('species.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # Optimistic concurrency: every write bumps version and checks the one it read
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+    species = db.relationship('Species', lazy='joined')
+    care_schedules = db.relationship('CareSchedule', backref='plant', lazy=True, cascade='all, delete-orphan', passive_deletes=True)
+
+    @property
+    def display_img_url(self):
+        if self.img_url is None and self.species is not None:
+            return self.species.img_url
+        return self.img_url
+
+    @property
+    def display_description(self):
+        if self.description is None and self.species is not None:
+            return self.species.description
+        return self.description
+
+    def set_species(self, name, description, img_url):
+        """Link to the catalogue entry for `name`, creating it if needed, and keep only real overrides."""
+        species = Species.for_name(name)
+        self.species = species
+        self.description = None if description == species.description else description
+        self.img_url = None if img_url == species.img_url else img_url
+
+    @classmethod
+    def override_values(cls, data, species=None):
+        """UPDATE values for description/img_url that keep only real overrides, like set_species().
+
+        `species` is the entry the plant is being relinked to, or None if it keeps
+        its current one. Fields missing from `data` keep what the user sees now.
+        """
+        values = {}
+        for field in ('description', 'img_url'):
+            column = getattr(cls, field)
+            current_species_value = db.select(getattr(Species, field)).where(Species.id == cls.species_id).scalar_subquery()
+            if field in data and species is not None:
+                value = data[field]
+                values[field] = None if value == getattr(species, field) else value
+            elif field in data:
+                values[field] = db.case((current_species_value == data[field], None), else_=data[field])
+            elif species is not None:
+                value = db.func.coalesce(column, current_species_value)
+                values[field] = db.case((value == getattr(species, field), None), else_=value)
+        return values
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'img_url': self.display_img_url,
+            'description': self.display_description,
+            'species_id': self.species_id,
+            'user_id': self.user_id,
+            'version': self.version
+        }
 
     def __repr__(self):
         return f'<Plant {self.name}>'
 
 class CareSchedule(db.Model):
+    __table_args__ = (db.Index('ix_care_schedule_plant_id_task', 'plant_id', 'task'),)
+
     id = db.Column(db.Integer, primary_key=True)
     task = db.Column(db.String(80), nullable=False)
     schedule_date = db.Column(db.Date, nullable=False)
     interval = db.Column(db.String(50), nullable=True)
-    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id'), nullable=False)  # Ensure this column is not nullable
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Ensure this column is not nullable
+    plant_id = db.Column(db.Integer, db.ForeignKey('plant.id', ondelete='CASCADE'), nullable=False)  # Ensure this column is not nullable
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)  # Ensure this column is not nullable
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def to_dict(self):
         return {
@@ -51,18 +200,23 @@ class CareSchedule(db.Model):
             'interval': self.interval,
             'plant_id': self.plant_id,
             'plant_name': self.plant.name,
-            'user_id': self.user_id
+            'user_id': self.user_id,
+            'version': self.version
         }
 
     def __repr__(self):
         return f'<CareSchedule {self.task} for Plant ID {self.plant_id}>'
 
 class Tip(db.Model):
+    __table_args__ = (db.Index('ix_tip_user_id_title', 'user_id', 'title'),)
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def to_dict(self):
         return {
@@ -70,36 +224,114 @@ class Tip(db.Model):
             'title': self.title,
             'content': self.content,
             'created_at': self.created_at.isoformat(),
-            'author': self.user.username  # Access `user` relationship
+            'author': self.user.username,  # Access `user` relationship
+            'version': self.version
         }
 
 
 class ForumPost(db.Model):
+    __table_args__ = (db.Index('ix_forum_post_user_id_title', 'user_id', 'title'),)
+
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    comments = db.relationship('Comment', backref='forum_post', lazy=True, cascade="all, delete-orphan")
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    # Ranking, maintained by ranking.ForumRanking; indexed so each sort is an ordered LIMIT
+    hot_score = db.Column(db.Float, nullable=False, default=1.0, server_default='1', index=True)
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_activity_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+    comments = db.relationship('Comment', backref='forum_post', lazy=True, cascade="all, delete-orphan", passive_deletes=True, order_by='Comment.path')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'content': self.content,
+            'author': self.user.username,
+            'created_at': self.created_at,
+            'hot_score': self.hot_score,
+            'comment_count': self.comment_count,
+            'last_activity_at': self.last_activity_at,
+            'version': self.version
+        }
 
     def __repr__(self):
         return f'<ForumPost {self.title}>'
 
+# Each comment's path is its ancestors' ids and its own, zero-padded so that sorting by path
+# lists a thread depth-first with replies in the order they were written
+COMMENT_PATH_SEGMENT = 11  # 10 digits and a '/'
+
+def comment_path_segment(comment_id):
+    return f'{comment_id:010d}/'
+
+def comment_subtree_range(path):
+    """Bounds of every path under `path`, itself included: path <= p < upper ('/' sorts just before '0')."""
+    return path, path[:-1] + '0'
+
 class Comment(db.Model):
+    __table_args__ = (db.Index('ix_comment_post_id_path', 'post_id', 'path'),)
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('forum_post.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey('forum_post.id', ondelete='CASCADE'), nullable=False)
+    parent_id = db.Column(db.Integer, db.ForeignKey('comment.id', ondelete='CASCADE'), index=True)  # NULL for top-level comments
+    path = db.Column(db.String(255), nullable=False, default='', server_default='')  # Filled in after insert, see _set_comment_path
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
+
+    @property
+    def depth(self):
+        return len(self.path) // COMMENT_PATH_SEGMENT
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'content': self.content,
+            'author': self.user.username,
+            'date_created': self.date_created,
+            'post_id': self.post_id,
+            'parent_id': self.parent_id,
+            'version': self.version
+        }
+
+@event.listens_for(Comment, 'after_insert')
+def _set_comment_path(mapper, connection, target):
+    # The path ends in the comment's own id, so it can only be written once the row has one
+    parent_path = ''
+    if target.parent_id is not None:
+        parent_path = connection.execute(db.select(Comment.path).where(Comment.id == target.parent_id)).scalar()
+    path = parent_path + comment_path_segment(target.id)
+    connection.execute(Comment.__table__.update().where(Comment.__table__.c.id == target.id).values(path=path))
+    set_committed_value(target, 'path', path)
+
+def fill_comment_paths():
+    """Give top-level paths to comments inserted in bulk (seed), which skip _set_comment_path."""
+    comments = Comment.__table__
+    ids = db.session.execute(db.select(comments.c.id).where(comments.c.path == '')).scalars().all()
+    if ids:
+        db.session.execute(
+            comments.update().where(comments.c.id == db.bindparam('comment_id')).values(path=db.bindparam('new_path')),
+            [{'comment_id': comment_id, 'new_path': comment_path_segment(comment_id)} for comment_id in ids]
+        )
 
 
 class Layout(db.Model):
+    __table_args__ = (db.Index('ix_layout_user_id_name', 'user_id', 'name'),)
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     layout_data = db.Column(db.Text, nullable=False)  # Store the layout data as a JSON string
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    __mapper_args__ = {'version_id_col': version}
 
     def to_dict(self):
         return {
@@ -108,5 +340,125 @@ class Layout(db.Model):
             'layout_data': json.loads(self.layout_data), 
             'user_id': self.user_id,
             'created_at': self.created_at,
-            'updated_at': self.updated_at
-        }
\ No newline at end of file
+            'updated_at': self.updated_at,
+            'version': self.version
+        }
+
+class ChangeLog(db.Model):
+    # Append-only record of every insert, update and delete, used by /sync.
+    # The autoincrement id doubles as the client's sync token.
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, index=True)  # Owner of the row; no FK so tombstones outlive the user
+    op = db.Column(db.String(10), nullable=False)  # 'upsert' or 'delete'
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ChangeLog {self.op} {self.table_name}:{self.row_id}>'
+
+
+class WeatherForecast(db.Model):
+    # Latest daily forecast per grid cell, shared by every user in the cell until it expires
+    cell = db.Column(db.String(32), primary_key=True)
+    fetched_at = db.Column(db.DateTime, nullable=False)
+    days = db.Column(db.Text, nullable=False)  # JSON [[iso date, rain mm], ...]
+
+    def __repr__(self):
+        return f'<WeatherForecast {self.cell} at {self.fetched_at}>'
+
+
+def _owner_id(obj):
+    return obj.id if isinstance(obj, User) else getattr(obj, 'user_id', None)
+
+def _change_log_rows(objects, op):
+    return [
+        {
+            'table_name': obj.__tablename__,
+            'row_id': obj.id,
+            'user_id': _owner_id(obj),
+            'op': op,
+            'changed_at': datetime.utcnow()
+        }
+        for obj in objects if isinstance(obj, db.Model) and not isinstance(obj, (ChangeLog, WeatherForecast))
+    ]
+
+def record_changes(session, table_name, rows, op):
+    """Log (row_id, user_id) pairs touched by a bulk UPDATE/DELETE, which skips the flush events."""
+    entries = [
+        {'table_name': table_name, 'row_id': row_id, 'user_id': user_id, 'op': op, 'changed_at': datetime.utcnow()}
+        for row_id, user_id in rows
+    ]
+    if entries:
+        session.execute(ChangeLog.__table__.insert(), entries)
+
+def link_species(user_id=None):
+    """Attach plants inserted in bulk (seed, import) to the species catalogue, set-based.
+
+    Creates missing species by name only, links the plants, then clears
+    descriptions and images that merely repeat the species values.
+    """
+    plant = Plant.__table__
+    species = Species.__table__
+    normalized = db.func.lower(db.func.trim(plant.c.name))
+    scope = [plant.c.user_id == user_id] if user_id is not None else []
+    unlinked = [plant.c.species_id.is_(None), *scope]
+
+    db.session.execute(species.insert().from_select(
+        ['name', 'normalized_name'],
+        db.select(db.func.min(db.func.trim(plant.c.name)), normalized)
+        .where(*unlinked, normalized.notin_(db.select(species.c.normalized_name)))
+        .group_by(normalized)
+    ))
+    db.session.execute(
+        plant.update().where(*unlinked).values(
+            species_id=db.select(species.c.id).where(species.c.normalized_name == normalized).scalar_subquery()
+        )
+    )
+    for column in ('description', 'img_url'):
+        species_value = db.select(species.c[column]).where(species.c.id == plant.c.species_id).scalar_subquery()
+        db.session.execute(
+            plant.update()
+            .where(plant.c.species_id.isnot(None), plant.c[column] == species_value, *scope)
+            .values({column: None})
+        )
+
+def delete_user_data(user_id):
+    """Remove a user and everything they own with one DELETE per table, without loading any rows.
+
+    Tombstones are logged for shared rows (tips, posts, comments) so other clients drop them on sync.
+    """
+    session = db.session
+    own_posts = db.select(ForumPost.id).where(ForumPost.user_id == user_id)
+    own_plants = db.select(Plant.id).where(Plant.user_id == user_id)
+    # Replies to the user's comments go with them (parent_id cascades), so they need tombstones too
+    own_comment = aliased(Comment)
+    in_own_threads = db.exists().where(
+        own_comment.user_id == user_id, own_comment.post_id == Comment.post_id,
+        own_comment.path != '', Comment.path.startswith(own_comment.path)
+    )
+    comments = Comment.query.filter(db.or_(Comment.user_id == user_id, Comment.post_id.in_(own_posts), in_own_threads))
+    schedules = CareSchedule.query.filter(db.or_(CareSchedule.user_id == user_id, CareSchedule.plant_id.in_(own_plants)))
+
+    record_changes(session, 'comment', comments.with_entities(Comment.id, Comment.user_id), 'delete')
+    record_changes(session, 'tip', session.query(Tip.id, Tip.user_id).filter_by(user_id=user_id), 'delete')
+    record_changes(session, 'forum_post', session.query(ForumPost.id, ForumPost.user_id).filter_by(user_id=user_id), 'delete')
+
+    # Children first, so this also works where the database does not enforce ON DELETE CASCADE
+    comments.delete(synchronize_session=False)
+    schedules.delete(synchronize_session=False)
+    for model in (Plant, Tip, Layout, ForumPost):
+        model.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    User.query.filter_by(id=user_id).delete(synchronize_session=False)
+
+@event.listens_for(Session, 'after_flush')
+def _log_flushed_changes(session, flush_context):
+    # new/dirty/deleted still hold the pre-flush state here, and new rows already have their ids
+    dirty = [obj for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    rows = (
+        _change_log_rows(session.new, 'upsert')
+        + _change_log_rows(dirty, 'upsert')
+        + _change_log_rows(session.deleted, 'delete')
+    )
+    if rows:
+        session.connection().execute(ChangeLog.__table__.insert(), rows)
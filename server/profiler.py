@@ -0,0 +1,151 @@
+import cProfile
+import hmac
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_placeholder_lists = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')  # Expanded IN (...) lists
+_whitespace = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    """Statement with literals and IN lists folded, so executions of the same query group together."""
+    statement = _literals.sub('?', statement)
+    statement = _placeholder_lists.sub('(?...)', statement)
+    return _whitespace.sub(' ', statement).strip()
+
+
+def _is_select(statement):
+    return statement.lstrip().upper().startswith('SELECT')
+
+
+def _param_types(parameters):
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+class QueryProfiler:
+    """Opt-in SQL profiling per request, enabled with PROFILER_ENABLED.
+
+    Every statement run through SQLAlchemy is timed and grouped by
+    fingerprint for the current request; the totals go to the debug log and
+    a Server-Timing header. Statements slower than PROFILER_SLOW_QUERY_MS are
+    written with their EXPLAIN output to a rotating PROFILER_SLOW_LOG; only
+    SELECTs have their parameters logged, writes just their types, as those
+    carry password hashes and user content. When PROFILER_TOKEN is set, a
+    request whose PROFILER_HEADER matches it is also run under cProfile and
+    dumped to PROFILER_DIR, for snakeviz, flameprof or pstats.
+    """
+
+    def __init__(self, app=None):
+        self.slow_log = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILER_ENABLED', False)
+        app.config.setdefault('PROFILER_SLOW_QUERY_MS', 100)
+        app.config.setdefault('PROFILER_SLOW_LOG', os.path.join(app.instance_path, 'slow_queries.log'))
+        app.config.setdefault('PROFILER_SLOW_LOG_BYTES', 5 * 1024 * 1024)
+        app.config.setdefault('PROFILER_SLOW_LOG_BACKUPS', 3)
+        app.config.setdefault('PROFILER_HEADER', 'X-Profile')
+        app.config.setdefault('PROFILER_TOKEN', None)
+        app.config.setdefault('PROFILER_DIR', os.path.join(app.instance_path, 'profiles'))
+        self.app = app
+        if not app.config['PROFILER_ENABLED']:
+            return
+
+        os.makedirs(os.path.dirname(app.config['PROFILER_SLOW_LOG']), exist_ok=True)
+        handler = RotatingFileHandler(
+            app.config['PROFILER_SLOW_LOG'],
+            maxBytes=app.config['PROFILER_SLOW_LOG_BYTES'],
+            backupCount=app.config['PROFILER_SLOW_LOG_BACKUPS']
+        )
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        self.slow_log = logging.getLogger('greenthumb.slow_queries')
+        self.slow_log.setLevel(logging.INFO)
+        self.slow_log.propagate = False
+        self.slow_log.addHandler(handler)
+
+        # Listening on Engine covers the primary and every read replica
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info['query_start_time'].pop()) * 1000
+        if has_request_context() and 'query_stats' in g:
+            stats = g.query_stats.setdefault(fingerprint(statement), [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed_ms
+        if elapsed_ms >= self.app.config['PROFILER_SLOW_QUERY_MS']:
+            self._log_slow_query(cursor, statement, parameters, executemany, elapsed_ms)
+
+    def _log_slow_query(self, cursor, statement, parameters, executemany, elapsed_ms):
+        endpoint = request.endpoint if has_request_context() else '-'
+        lines = [f'{elapsed_ms:.1f} ms [{endpoint}] {_whitespace.sub(" ", statement).strip()}']
+        if executemany:
+            lines.append(f'  {len(parameters)} parameter sets')
+        elif _is_select(statement):
+            lines.append(f'  params: {parameters!r}')
+            lines.extend(f'  {line}' for line in self._explain(cursor, statement, parameters))
+        else:
+            lines.append(f'  param types: {_param_types(parameters)}')
+        self.slow_log.info('\n'.join(lines))
+
+    def _explain(self, cursor, statement, parameters):
+        # A fresh DBAPI cursor on the same connection, so the plan does not go through these events
+        dbapi_connection = cursor.connection
+        prefix = 'EXPLAIN QUERY PLAN ' if isinstance(dbapi_connection, sqlite3.Connection) else 'EXPLAIN '
+        explain_cursor = dbapi_connection.cursor()
+        try:
+            explain_cursor.execute(prefix + statement, parameters)
+            return [' | '.join(str(value) for value in row) for row in explain_cursor.fetchall()]
+        except Exception as e:
+            return [f'EXPLAIN failed: {e}']
+        finally:
+            explain_cursor.close()
+
+    def _profile_requested(self):
+        token = self.app.config['PROFILER_TOKEN']
+        value = request.headers.get(self.app.config['PROFILER_HEADER'])
+        return bool(token) and value is not None and hmac.compare_digest(value.encode(), token.encode())
+
+    def _before_request(self):
+        g.query_stats = {}
+        if self._profile_requested():
+            g.cprofile = cProfile.Profile()
+            g.cprofile.enable()
+
+    def _after_request(self, response):
+        profile = g.pop('cprofile', None)
+        if profile is not None:
+            # Streamed bodies are produced after this point and are not included
+            profile.disable()
+            os.makedirs(self.app.config['PROFILER_DIR'], exist_ok=True)
+            filename = f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{request.endpoint or "unknown"}.prof'
+            profile.dump_stats(os.path.join(self.app.config['PROFILER_DIR'], filename))
+            response.headers['X-Profile-File'] = filename
+
+        stats = g.get('query_stats') or {}
+        count = sum(calls for calls, _ in stats.values())
+        total_ms = sum(ms for _, ms in stats.values())
+        response.headers.add('Server-Timing', f'db;dur={total_ms:.1f};desc="{count} queries"')
+        if stats and self.app.logger.isEnabledFor(logging.DEBUG):
+            self.app.logger.debug('%s %s: %d queries in %.1f ms', request.method, request.path, count, total_ms)
+            for text, (calls, ms) in sorted(stats.items(), key=lambda item: -item[1][1]):
+                self.app.logger.debug('  %6.1f ms %3dx %s', ms, calls, text)
+        return response
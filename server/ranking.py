@@ -0,0 +1,135 @@
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from models import db, ForumPost, Comment, record_changes
+
+forum_cli = AppGroup('forum', help='Maintain forum thread rankings.')
+
+# Orderings offered by GET /forum_posts?sort=..., each walking an index on the first column
+SORTS = {
+    'hot': (ForumPost.hot_score.desc(), ForumPost.id.desc()),
+    'new': (ForumPost.created_at.desc(), ForumPost.id.desc()),
+    'active': (ForumPost.last_activity_at.desc(), ForumPost.id.desc()),
+}
+COMMENT_WEIGHT = 1.0  # A new post starts at 1.0, see ForumPost.hot_score
+MIN_SCORE = 0.01  # Decayed below this a post counts as cold and drops to 0, so decay stops rewriting it
+
+
+def decayed(weight, since, half_life_hours, now=None):
+    """What `weight` added at `since` is worth now, having halved every `half_life_hours`."""
+    age_hours = max(((now or datetime.utcnow()) - since).total_seconds() / 3600, 0)
+    return weight * 0.5 ** (age_hours / half_life_hours)
+
+
+class ForumRanking:
+    """Keeps ForumPost.hot_score, comment_count and last_activity_at up to date.
+
+    Comments adjust their post with a single UPDATE in the same transaction,
+    so listing hot threads never aggregates comments. Scores halve every
+    FORUM_HOT_HALF_LIFE_HOURS through `flask forum decay`, a batch job meant
+    to run from cron. The UPDATEs skip the flush events, so each one logs its
+    posts to the change log itself.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FORUM_HOT_HALF_LIFE_HOURS', 24)
+        app.config.setdefault('FORUM_PAGE_SIZE', 50)
+        self.app = app
+        app.extensions['forum_ranking'] = self
+        app.cli.add_command(forum_cli)
+
+    def _update_posts(self, statement):
+        rows = db.session.execute(
+            statement.returning(ForumPost.id, ForumPost.user_id).execution_options(synchronize_session=False)
+        ).all()
+        record_changes(db.session, 'forum_post', rows, 'upsert')
+        return rows
+
+    def comment_added(self, post_id, created_at):
+        self._update_posts(
+            db.update(ForumPost).where(ForumPost.id == post_id)
+            .values(
+                hot_score=ForumPost.hot_score + COMMENT_WEIGHT,
+                comment_count=ForumPost.comment_count + 1,
+                last_activity_at=created_at
+            )
+        )
+
+    def comments_removed(self, post_id, comments):
+        """`comments` are (id, date_created) pairs: a deleted comment and the replies deleted with it."""
+        # Take back only what the comments are still worth after decay
+        half_life = self.app.config['FORUM_HOT_HALF_LIFE_HOURS']
+        weight = sum(decayed(COMMENT_WEIGHT, created_at, half_life) for _, created_at in comments)
+        removed = len(comments)
+        self._update_posts(
+            db.update(ForumPost).where(ForumPost.id == post_id)
+            .values(
+                hot_score=db.case((ForumPost.hot_score > weight, ForumPost.hot_score - weight), else_=0),
+                comment_count=db.case((ForumPost.comment_count > removed, ForumPost.comment_count - removed), else_=0),
+                last_activity_at=self._last_activity(Comment.id.not_in([comment_id for comment_id, _ in comments]))
+            )
+        )
+
+    def refresh_activity(self, post_ids):
+        """Recount comments, last activity and hot score for posts whose comments changed in bulk."""
+        scores = self.hot_scores(post_ids) if post_ids else {}
+        if not scores:  # No posts, or all of them deleted too
+            return
+        comment_count = (
+            db.select(db.func.count(Comment.id)).where(Comment.post_id == ForumPost.id).scalar_subquery()
+        )
+        self._update_posts(
+            db.update(ForumPost).where(ForumPost.id.in_(scores))
+            .values(
+                hot_score=db.case(scores, value=ForumPost.id, else_=ForumPost.hot_score),
+                comment_count=comment_count,
+                last_activity_at=self._last_activity()
+            )
+        )
+
+    def hot_scores(self, post_ids):
+        """{post id: score} recomputed from the posts' remaining comments, as if decayed continuously."""
+        half_life = self.app.config['FORUM_HOT_HALF_LIFE_HOURS']
+        now = datetime.utcnow()
+        scores = {
+            post_id: decayed(1.0, created_at, half_life, now)
+            for post_id, created_at in db.session.execute(db.select(ForumPost.id, ForumPost.created_at).where(ForumPost.id.in_(post_ids)))
+        }
+        comments = db.select(Comment.post_id, Comment.date_created).where(Comment.post_id.in_(post_ids))
+        for post_id, created_at in db.session.execute(comments):
+            scores[post_id] += decayed(COMMENT_WEIGHT, created_at, half_life, now)
+        return {post_id: score if score >= MIN_SCORE else 0 for post_id, score in scores.items()}
+
+    def _last_activity(self, *criteria):
+        latest_comment = (
+            db.select(db.func.max(Comment.date_created))
+            .where(Comment.post_id == ForumPost.id, *criteria)
+            .scalar_subquery()
+        )
+        return db.func.coalesce(latest_comment, ForumPost.created_at)
+
+    def decay(self, hours):
+        """Age every warm post by `hours` in one UPDATE; returns how many rows it touched."""
+        factor = 0.5 ** (hours / self.app.config['FORUM_HOT_HALF_LIFE_HOURS'])
+        decayed_score = ForumPost.hot_score * factor
+        rows = self._update_posts(
+            db.update(ForumPost).where(ForumPost.hot_score > 0)
+            .values(hot_score=db.case((decayed_score < MIN_SCORE, 0), else_=decayed_score))
+        )
+        return len(rows)
+
+
+@forum_cli.command('decay')
+@click.option('--hours', type=float, default=1.0, show_default=True,
+              help='Time since the previous run; schedule the job at this interval.')
+def decay_scores(hours):
+    """Decay forum hot scores (run from cron)."""
+    ranking = current_app.extensions['forum_ranking']
+    rows = ranking.decay(hours)
+    db.session.commit()
+    click.echo(f'Decayed {rows} forum posts by {hours:g} hours')
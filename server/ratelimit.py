@@ -0,0 +1,253 @@
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import request, jsonify, g
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+# A bucket idle this long has refilled under any limit, so forgetting it changes nothing
+BUCKET_TTL = max(PERIODS.values())
+
+
+def parse_limit(limit):
+    """Turn '5/minute' into (capacity, tokens refilled per second)."""
+    count, _, period = limit.partition('/')
+    count = int(count)
+    return count, count / PERIODS[period.strip()]
+
+
+def _refill(tokens, updated, capacity, rate, now):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+def _take(tokens, rate):
+    """Returns (allowed, tokens left, seconds until a token is available)."""
+    if tokens >= 1:
+        return True, tokens - 1, 0
+    return False, tokens, math.ceil((1 - tokens) / rate)
+
+
+class MemoryBackend:
+    """Per-process buckets. Good for a single worker or for tests.
+
+    At most MAX_KEYS buckets are kept; the least recently used go first.
+    """
+
+    MAX_KEYS = 10000
+
+    def __init__(self):
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated, capacity, rate, now)
+            allowed, tokens, retry_after = _take(tokens, rate)
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.MAX_KEYS:
+                self.buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+class SQLiteBackend:
+    """Buckets in a local SQLite file, shared by every gunicorn worker on the host.
+
+    Buckets untouched for BUCKET_TTL seconds are deleted every PRUNE_SECONDS.
+    The file is only created by the first rate-limited request, so importing
+    the app for CLI commands leaves no trace.
+    """
+
+    PRUNE_SECONDS = 300
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.pruned_at = time.time()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+        return conn
+
+    @property
+    def conn(self):
+        if not hasattr(self.local, 'conn'):
+            self.local.conn = self._connect()
+        return self.local.conn
+
+    def consume(self, key, capacity, rate):
+        conn = self.conn
+        # BEGIN IMMEDIATE takes the write lock up front so read-modify-write is atomic across processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = _refill(tokens, updated, capacity, rate, now)
+            allowed, tokens, retry_after = _take(tokens, rate)
+            conn.execute(
+                'INSERT INTO bucket (key, tokens, updated) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated',
+                (key, tokens, now)
+            )
+            if now - self.pruned_at > self.PRUNE_SECONDS:
+                self.pruned_at = now
+                conn.execute('DELETE FROM bucket WHERE updated < ?', (now - BUCKET_TTL,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+
+def queue_delay(value, now):
+    """Seconds since the proxy stamped a request, from 't=1700000000.123' or a bare timestamp.
+
+    nginx and most proxies send seconds; some send milliseconds or microseconds,
+    told apart by size. None when the header is missing or unreadable.
+    """
+    if not value:
+        return None
+    try:
+        started = float(value.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(now - started, 0)
+
+
+def make_backend(uri):
+    if uri == 'memory':
+        return MemoryBackend()
+    if uri.startswith('sqlite:///'):
+        return SQLiteBackend(uri[len('sqlite:///'):])
+    raise ValueError(f'Unknown rate limit backend: {uri}')
+
+
+def too_many_requests(retry_after, message='Too many requests'):
+    response = jsonify({'error': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, int(retry_after)))
+    return response
+
+
+class RateLimiter:
+    """Token-bucket rate limiting per IP and per JWT identity, plus load shedding.
+
+    Limits are looked up in RATELIMIT_ROUTES by endpoint name first, then by
+    blueprint name, and fall back to RATELIMIT_DEFAULT.
+
+    Load is shed on admission delay: a request that already waited over
+    SHED_MAX_QUEUE_MS between the proxy stamping SHED_QUEUE_HEADER and a
+    worker picking it up is turned away, so a backed-up queue drains instead
+    of serving clients that gave up. The average service time of requests
+    is a second signal (SHED_MAX_LATENCY_MS) for when the database is the
+    bottleneck; streamed bodies (exports, imports, feeds) are left out of
+    it, and it halves every SHED_LATENCY_HALF_LIFE seconds of wall-clock
+    time, so one slow request cannot hold shedding on.
+
+    Clients are told apart by IP. Behind a reverse proxy, set
+    RATELIMIT_PROXY_HOPS to the number of proxies in front of the app so the
+    client address is taken from X-Forwarded-For; otherwise every request
+    shares the proxy's address. Leave it at 0 when clients connect directly,
+    as they could then forge the header to dodge their limits.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.avg_latency = 0.0
+        self.latency_at = time.monotonic()
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATELIMIT_DEFAULT', '120/minute')
+        app.config.setdefault('RATELIMIT_ROUTES', {})
+        app.config.setdefault('SHED_QUEUE_HEADER', 'X-Request-Start')
+        app.config.setdefault('SHED_MAX_QUEUE_MS', 1000)
+        app.config.setdefault('SHED_MAX_LATENCY_MS', 2000)
+        app.config.setdefault('SHED_LATENCY_HALF_LIFE', 5)
+        app.config.setdefault('RATELIMIT_PROXY_HOPS', 0)
+        self.app = app
+        if app.config['RATELIMIT_PROXY_HOPS']:
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['RATELIMIT_PROXY_HOPS'])
+        self.backend = make_backend(app.config['RATELIMIT_BACKEND'])
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def limit_for(self, endpoint, blueprint):
+        routes = self.app.config['RATELIMIT_ROUTES']
+        limit = routes.get(endpoint) or routes.get(blueprint) or self.app.config['RATELIMIT_DEFAULT']
+        return parse_limit(limit) if limit else None
+
+    def _identity(self):
+        try:
+            verify_jwt_in_request(optional=True)
+            return get_jwt_identity()
+        except Exception:
+            # Bad or expired tokens are rejected by the route itself; limit them by IP only
+            return None
+
+    def _latency(self, now):
+        # Caller holds the lock
+        return self.avg_latency * 0.5 ** (max(now - self.latency_at, 0) / self.app.config['SHED_LATENCY_HALF_LIFE'])
+
+    def _shed(self):
+        config = self.app.config
+        waited = queue_delay(request.headers.get(config['SHED_QUEUE_HEADER']), time.time())
+        if waited is not None and waited * 1000 > config['SHED_MAX_QUEUE_MS']:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            if self._latency(now) * 1000 > config['SHED_MAX_LATENCY_MS']:
+                return True
+        g.admitted_at = now
+        return False
+
+    def _before_request(self):
+        if not self.app.config['RATELIMIT_ENABLED'] or request.method == 'OPTIONS' or request.endpoint is None:
+            return None
+
+        if self._shed():
+            return too_many_requests(1, 'Server is busy, try again shortly')
+
+        limit = self.limit_for(request.endpoint, request.blueprint)
+        if limit is None:
+            return None
+        capacity, rate = limit
+
+        keys = [f'ip:{request.remote_addr}:{request.endpoint}']
+        user_id = self._identity()
+        if user_id is not None:
+            keys.append(f'user:{user_id}:{request.endpoint}')
+
+        for key in keys:
+            allowed, retry_after = self.backend.consume(key, capacity, rate)
+            if not allowed:
+                return too_many_requests(retry_after)
+        return None
+
+    def _after_request(self, response):
+        admitted_at = g.pop('admitted_at', None)
+        if admitted_at is None or response.is_streamed:
+            # A streamed body is produced after this point and its length says nothing about load
+            return response
+        now = time.monotonic()
+        with self.lock:
+            # Exponentially weighted so a single slow request does not trip shedding
+            self.avg_latency = 0.9 * self._latency(now) + 0.1 * (now - admitted_at)
+            self.latency_at = now
+        return response
@@ -0,0 +1,246 @@
+import math
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date
+import numpy as np
+from models import db, Tip, Plant, CareSchedule
+from calendar_feed import RRULES
+
+TITLE_WEIGHT = 2  # Title words count this many times over content words
+STOP_WORDS = frozenset(
+    'a about after all also an and any are as at be been before but by can do does for from get has have how i if in '
+    'into is it its just keep make more most my no not of on once or out over so some than that the their them then '
+    'there these they this to too up use was we what when where which while who why will with you your'.split()
+)
+_words = re.compile(r'[a-z]+')
+_SUFFIXES = ('ing', 'es', 'ed', 's', 'e')
+
+
+def stem(word):
+    """Crude suffix stripping, enough to match 'Watering' with 'water' and 'tomatoes' with 'Tomato'."""
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and not (suffix == 's' and word.endswith('ss')):
+            return word[:-len(suffix)]
+    return word
+
+
+def terms(text, weight=1):
+    counts = Counter()
+    for word in _words.findall(text.lower()):
+        if word not in STOP_WORDS:
+            counts[stem(word)] += weight
+    return counts
+
+
+def tip_terms(title, content):
+    return terms(title or '', TITLE_WEIGHT) + terms(content or '')
+
+
+class TipIndex:
+    """TF-IDF vectors of tips, stored as postings: term -> (row numbers, weights).
+
+    Weights are (1 + log tf) * idf, normalised per tip, so a query's score
+    for a tip is a dot product that only touches the postings of the query's
+    own terms. Added tips are weighted with the idf of the moment and kept in
+    plain lists, as growing a numpy array copies it; removed tips only leave
+    a hole. All of it is folded into the arrays at the next full build.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.df = Counter()
+        self.rows = {}  # tip id -> row
+        self.tip_ids = np.zeros(0, dtype=np.int64)  # row -> tip id, for the rows of the last build
+        self.added_ids = []  # Tip ids of the rows added since, numbered on from the built ones
+        self.added_postings = {}  # term -> [(row, weight)] for the added rows
+        self.removed_rows = []
+        self.row_terms = []  # row -> its terms, to take them out of df again
+        self.size = 0
+
+    @classmethod
+    def build(cls, tips):
+        """Index (tip id, title, content) rows in bulk."""
+        index = cls()
+        counts = []
+        for tip_id, title, content in tips:
+            index.rows[tip_id] = len(counts)
+            counts.append(tip_terms(title, content))
+        for doc in counts:
+            index.df.update(doc.keys())
+        index.size = len(counts)
+        index.tip_ids = np.fromiter(index.rows, dtype=np.int64, count=len(counts))
+        index.row_terms = [list(doc) for doc in counts]
+        if not index.df:
+            return index
+
+        vocabulary = list(index.df)
+        term_numbers = {term: i for i, term in enumerate(vocabulary)}
+        lengths = np.fromiter((len(doc) for doc in counts), dtype=np.int64, count=len(counts))
+        rows = np.repeat(np.arange(len(counts), dtype=np.int32), lengths)
+        term_ids = np.fromiter((term_numbers[term] for doc in counts for term in doc), dtype=np.int64, count=len(rows))
+        tf = np.fromiter((count for doc in counts for count in doc.values()), dtype=np.float64, count=len(rows))
+        idf = np.log((1 + index.size) / (1 + np.fromiter(index.df.values(), dtype=np.float64, count=len(vocabulary)))) + 1
+
+        weights = (1 + np.log(tf)) * idf[term_ids]
+        weights /= np.sqrt(np.bincount(rows, weights=weights ** 2, minlength=len(counts)))[rows]
+        # Group the (row, weight) pairs by term with one sort
+        order = np.argsort(term_ids, kind='stable')
+        rows, weights = rows[order], weights[order].astype(np.float32)
+        bounds = np.searchsorted(term_ids[order], np.arange(len(vocabulary) + 1))
+        for i, term in enumerate(vocabulary):
+            index.postings[term] = (rows[bounds[i]:bounds[i + 1]], weights[bounds[i]:bounds[i + 1]])
+        return index
+
+    def idf(self, term):
+        return math.log((1 + self.size) / (1 + self.df[term])) + 1
+
+    @property
+    def removed(self):
+        return len(self.row_terms) - self.size
+
+    def add(self, tip_id, title, content):
+        self.remove(tip_id)
+        doc = tip_terms(title, content)
+        row = len(self.row_terms)
+        self.rows[tip_id] = row
+        self.added_ids.append(tip_id)
+        self.row_terms.append(list(doc))
+        self.df.update(doc.keys())
+        self.size += 1
+
+        weights = {term: (1 + math.log(count)) * self.idf(term) for term, count in doc.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        for term, weight in weights.items():
+            self.added_postings.setdefault(term, []).append((row, weight / norm))
+
+    def remove(self, tip_id):
+        row = self.rows.pop(tip_id, None)
+        if row is None:
+            return
+        self.removed_rows.append(row)
+        self.df.subtract(self.row_terms[row])
+        for term in self.row_terms[row]:
+            if self.df[term] <= 0:
+                del self.df[term]
+                self.postings.pop(term, None)
+                self.added_postings.pop(term, None)
+        self.row_terms[row] = []
+        self.size -= 1
+
+    def search(self, query, limit):
+        """The `limit` best (tip id, score) matches for a Counter of query terms."""
+        scores = np.zeros(len(self.row_terms), dtype=np.float32)
+        for term, count in query.items():
+            query_weight = np.float32((1 + math.log(count)) * self.idf(term))
+            posting = self.postings.get(term)
+            if posting is not None:
+                rows, weights = posting
+                scores[rows] += query_weight * weights
+            for row, weight in self.added_postings.get(term, ()):
+                scores[row] += query_weight * weight
+        scores[self.removed_rows] = 0
+        found = min(limit, int(np.count_nonzero(scores > 0)))
+        if found == 0:
+            return []
+        top = np.argpartition(-scores, found - 1)[:found]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(self._tip_id(row), float(scores[row])) for row in top]
+
+    def _tip_id(self, row):
+        built = len(self.tip_ids)
+        return int(self.tip_ids[row]) if row < built else self.added_ids[row - built]
+
+
+def profile_terms(user_id, today=None):
+    """What a user grows and does: their plant names plus their upcoming care tasks."""
+    today = today or date.today()
+    query = Counter()
+    for name in db.session.execute(db.select(Plant.name).where(Plant.user_id == user_id)).scalars():
+        query.update(terms(name))
+    upcoming = db.or_(CareSchedule.schedule_date >= today, db.func.lower(db.func.trim(CareSchedule.interval)).in_(list(RRULES)))
+    for task in db.session.execute(db.select(CareSchedule.task).where(CareSchedule.user_id == user_id, upcoming)).scalars():
+        query.update(terms(task))
+    return query
+
+
+class TipRecommender:
+    """Recommends tips matching a user's plants and upcoming care tasks.
+
+    Keeps a TipIndex per worker. Routes update it with put()/discard(), and
+    like the typeahead it is rebuilt every TIP_INDEX_REBUILD_SECONDS to pick
+    up other workers' writes, or sooner once more than half of its rows are
+    removed tips. Builds run in a background thread, the first one included,
+    so until a worker's first build finishes it recommends nothing.
+    """
+
+    def __init__(self, app=None):
+        self.index = None
+        self.lock = threading.Lock()
+        self.built_at = 0
+        self.rebuilding = False
+        self.missed = None  # (TipIndex method, args) for writes made while a build is reading
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TIP_INDEX_REBUILD_SECONDS', 600)
+        self.app = app
+        app.extensions['tip_recommender'] = self
+        app.before_request(self._before_request)
+
+    def _before_request(self):
+        stale = self.index is None or time.monotonic() - self.built_at > self.app.config['TIP_INDEX_REBUILD_SECONDS']
+        if stale and not self.rebuilding:
+            self.rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            with self.app.app_context():
+                self.rebuild()
+        finally:
+            self.rebuilding = False
+
+    def invalidate(self):
+        self.built_at = 0
+
+    def rebuild(self):
+        with self.lock:
+            self.missed = []
+        rows = db.session.execute(db.select(Tip.id, Tip.title, Tip.content).execution_options(yield_per=1000))
+        index = TipIndex.build(rows)
+        with self.lock:
+            # Replaying is safe for rows the build already saw: add() replaces and remove() ignores unknown ids
+            for method, args in self.missed:
+                method(index, *args)
+            self.missed = None
+            self.index = index
+            self.built_at = time.monotonic()
+
+    def put(self, tip_id, title, content):
+        self._apply(TipIndex.add, tip_id, title, content)
+
+    def discard(self, tip_id):
+        self._apply(TipIndex.remove, tip_id)
+
+    def _apply(self, method, *args):
+        with self.lock:
+            if self.missed is not None:
+                self.missed.append((method, args))
+            if self.index is not None:
+                method(self.index, *args)
+                self._compact_if_sparse()
+
+    def _compact_if_sparse(self):
+        # Edits and deletes leave dead rows that every search still allocates scores for
+        if self.index.removed > self.index.size:
+            self.invalidate()
+
+    def recommend(self, user_id, limit):
+        query = profile_terms(user_id)
+        if not query or self.index is None:
+            return []
+        with self.lock:
+            return self.index.search(query, limit)
@@ -0,0 +1,145 @@
+import itertools
+import os
+import sqlite3
+import threading
+import time
+import click
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask.cli import AppGroup
+from flask_sqlalchemy.session import Session
+
+READ_METHODS = {'GET', 'HEAD'}
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+PIN_COOKIE = 'primary_until'
+
+replicas_cli = AppGroup('replicas', help='Manage read replicas.')
+
+
+class RoutingSession(Session):
+    """Sends SELECTs from read-only requests to the replica chosen for the request.
+
+    Flushes, DML and anything outside a request always go to the primary.
+    Statements on sharded tables go to their shard instead, see shards.py.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shards = current_app.extensions.get('shards') if bind is None and has_app_context() else None
+        if shards is not None and shards.enabled:
+            shard = shards.get_bind(self, mapper, clause)
+            if shard is not None:
+                return shard
+        if bind is None and not self._flushing and getattr(clause, 'is_select', False) and has_request_context():
+            replica = g.get('read_replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class ReplicaPool:
+    """Round-robin over replica engines, skipping those that failed the last health check."""
+
+    def __init__(self, engines, check_interval):
+        self.engines = engines
+        self.healthy = list(engines)
+        self.check_interval = check_interval
+        self.last_check = time.monotonic()
+        self.counter = itertools.count()
+        self.check_lock = threading.Lock()
+
+    def check(self):
+        healthy = []
+        for engine in self.engines:
+            try:
+                with engine.connect() as conn:
+                    conn.execute(sa.text('SELECT 1'))
+                healthy.append(engine)
+            except sa.exc.SQLAlchemyError:
+                current_app.logger.warning('Replica %s failed its health check', engine.url)
+        self.healthy = healthy
+        self.last_check = time.monotonic()
+
+    def pick(self):
+        # Only one thread re-checks; the others keep using the previous result
+        if time.monotonic() - self.last_check > self.check_interval and self.check_lock.acquire(blocking=False):
+            try:
+                self.check()
+            finally:
+                self.check_lock.release()
+        healthy = self.healthy
+        if not healthy:
+            return None
+        return healthy[next(self.counter) % len(healthy)]
+
+
+def _resolve_sqlite_url(url, instance_path):
+    # Match Flask-SQLAlchemy, which puts relative SQLite paths in the instance folder
+    url = sa.engine.make_url(url)
+    if url.drivername.startswith('sqlite') and url.database not in (None, '', ':memory:') and not os.path.isabs(url.database):
+        url = url.set(database=os.path.join(instance_path, url.database))
+    return url
+
+
+class ReplicaRouter:
+    """Routes GET/HEAD traffic to read replicas listed in SQLALCHEMY_REPLICA_URIS.
+
+    After a successful write the client is pinned to the primary for
+    REPLICA_PIN_SECONDS via a cookie, so it reads its own writes even when the
+    follow-up request lands on another worker.
+    """
+
+    def __init__(self, app=None):
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_HEALTH_CHECK_INTERVAL', 30)
+        app.config.setdefault('REPLICA_PIN_SECONDS', 5)
+        self.app = app
+
+        uris = app.config['SQLALCHEMY_REPLICA_URIS']
+        if uris:
+            engines = [sa.create_engine(_resolve_sqlite_url(uri, app.instance_path)) for uri in uris]
+            self.pool = ReplicaPool(engines, app.config['REPLICA_HEALTH_CHECK_INTERVAL'])
+
+        app.extensions['replicas'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.cli.add_command(replicas_cli)
+
+    def _pinned_to_primary(self):
+        try:
+            return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def _before_request(self):
+        if self.pool is not None and request.method in READ_METHODS and not self._pinned_to_primary():
+            g.read_replica = self.pool.pick()
+
+    def _after_request(self, response):
+        if self.pool is not None and request.method in WRITE_METHODS and response.status_code < 400:
+            pin = self.app.config['REPLICA_PIN_SECONDS']
+            response.set_cookie(PIN_COOKIE, str(time.time() + pin), max_age=pin, httponly=True)
+        return response
+
+
+@replicas_cli.command('copy')
+def copy_replicas():
+    """Copy the primary SQLite database onto every SQLite replica (for local testing)."""
+    router = current_app.extensions['replicas']
+    db = current_app.extensions['sqlalchemy']
+    primary_url = db.engine.url
+    if not primary_url.drivername.startswith('sqlite') or router.pool is None:
+        raise click.ClickException('Replica copying needs a SQLite primary and at least one replica configured.')
+
+    source = sqlite3.connect(primary_url.database)
+    for engine in router.pool.engines:
+        target = sqlite3.connect(engine.url.database)
+        # The backup API gives a consistent snapshot even while the primary is being written
+        source.backup(target)
+        target.close()
+        click.echo(f'Copied {primary_url.database} -> {engine.url.database}')
+    source.close()
@@ -1,202 +1,350 @@
-from app import app, db
-from models import User, Plant, CareSchedule, Tip, Layout, ForumPost, Comment
-from datetime import datetime
+import argparse
+import csv
+import itertools
 import json
+import os
+import sys
+from datetime import datetime
+from sqlalchemy import and_, bindparam, exists, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from werkzeug.security import generate_password_hash
+from app import app, db
+from models import User, Plant, CareSchedule, Tip, Layout, ForumPost, Comment, ChangeLog, link_species, fill_comment_paths
+from shards import CENTRAL, rebalance, use_shard
+
+TOMATO_IMG = 'https://plus.unsplash.com/premium_photo-1669906333449-5fc2c47cd8ec?q=80&w=387&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D'
+BASIL_IMG = 'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRwl3tBPY4s-7hS8sRWGPQgeJ1DX0vBhDpMug&usqp=CAU'
+
+# Sample data, in the same record format as NDJSON fixtures
+SAMPLE_RECORDS = [
+    {'type': 'user', 'username': 'Riko-04', 'email': 'echoge11@gmail.com', 'password': 'Kiptoosky@04'},
+    {'type': 'user', 'username': 'testuser', 'email': 'testuser@gmail.com', 'password': 'password123'},
+
+    {'type': 'plant', 'user': 'Riko-04', 'name': 'Tomato', 'img_url': TOMATO_IMG,
+     'description': 'A red, juicy fruit often used in salads and cooking.'},
+    {'type': 'plant', 'user': 'testuser', 'name': 'Basil', 'img_url': BASIL_IMG,
+     'description': 'A fragrant herb commonly used in Italian cuisine.'},
+
+    {'type': 'care_schedule', 'user': 'Riko-04', 'plant_name': 'Tomato', 'task': 'Watering', 'schedule_date': '2024-08-01', 'interval': 'Daily'},
+    {'type': 'care_schedule', 'user': 'testuser', 'plant_name': 'Basil', 'task': 'Pruning', 'schedule_date': '2024-08-02', 'interval': 'Fortnightly'},
+
+    {'type': 'tip', 'user': 'Riko-04', 'title': 'Watering Tips', 'content': 'Water your plants regularly.'},
+    {'type': 'tip', 'user': 'testuser', 'title': 'Pruning Tips', 'content': 'Prune your plants to promote growth.'},
+
+    {'type': 'forum_post', 'user': 'Riko-04', 'title': 'Help with tomatoes', 'content': 'My tomatoes are not growing well.'},
+    {'type': 'forum_post', 'user': 'testuser', 'title': 'Basil care', 'content': 'How do I take care of basil?'},
+
+    {'type': 'comment', 'user': 'testuser', 'post_title': 'Help with tomatoes', 'content': 'Try using more fertilizer.'},
+    {'type': 'comment', 'user': 'Riko-04', 'post_title': 'Basil care', 'content': 'Make sure it gets enough sunlight.'},
+
+    {'type': 'layout', 'user': 'Riko-04', 'name': 'My Vegetable Garden',
+     'layout_data': [{'name': 'Tomato', 'img_url': TOMATO_IMG, 'position': {'x': 0, 'y': 1}}],
+     'created_at': '2024-09-18T00:00:00', 'updated_at': '2024-10-18T00:00:00'},
+    {'type': 'layout', 'user': 'testuser', 'name': 'Herb Garden',
+     'layout_data': [{'name': 'Basil', 'img_url': BASIL_IMG, 'position': {'x': 0, 'y': 1}}],
+     'created_at': '2024-09-18T00:00:00', 'updated_at': '2024-10-18T00:00:00'},
+]
+
+# Parents before children, so every reference in a batch can be resolved
+RECORD_TYPES = ['user', 'plant', 'care_schedule', 'tip', 'forum_post', 'comment', 'layout']
+MODELS = {
+    'user': User, 'plant': Plant, 'care_schedule': CareSchedule, 'tip': Tip,
+    'forum_post': ForumPost, 'comment': Comment, 'layout': Layout,
+}
+# Columns that identify a row for idempotent re-seeding
+NATURAL_KEYS = {
+    'plant': ('user_id', 'name'),
+    'care_schedule': ('plant_id', 'task'),
+    'tip': ('user_id', 'title'),
+    'forum_post': ('user_id', 'title'),
+    'comment': ('post_id', 'user_id', 'content'),
+    'layout': ('user_id', 'name'),
+}
+# CSV files carry no type column by default; it is taken from the file name (plants.csv -> plant)
+FILE_TYPES = {f'{record_type}s': record_type for record_type in RECORD_TYPES}
+
+
+def insert_ignoring_duplicates(table, key, columns):
+    """INSERT that silently skips rows whose natural key already exists.
+
+    Users have real unique constraints, so they get ON CONFLICT DO NOTHING.
+    The other natural keys are not unique in the schema (a gardener may own two
+    plants with the same name through the API), so those inserts are guarded
+    with NOT EXISTS instead.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if table is User.__table__ and dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        return insert(table).on_conflict_do_nothing()
+
+    values = select(*[bindparam(column, type_=table.c[column].type) for column in columns])
+    duplicate = exists().where(and_(*[table.c[column] == bindparam(column) for column in key]))
+    return table.insert().from_select(columns, values.where(~duplicate))
+
+
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def _user_ids(usernames):
+    # One IN query per batch instead of one query per row
+    usernames = set(usernames)
+    if not usernames:
+        return {}
+    return dict(db.session.execute(select(User.username, User.id).where(User.username.in_(usernames))).all())
+
+
+def _plant_ids(pairs):
+    """Map (user_id, plant name) to plant id, with one query per user in the batch."""
+    plant_ids = {}
+    for user_id, group in itertools.groupby(sorted(set(pairs)), key=lambda pair: pair[0]):
+        names = [name for _, name in group]
+        rows = db.session.execute(select(Plant.name, Plant.id).where(Plant.user_id == user_id, Plant.name.in_(names)))
+        plant_ids.update({(user_id, name): plant_id for name, plant_id in rows})
+    return plant_ids
+
+
+def _post_ids(titles):
+    titles = set(titles)
+    if not titles:
+        return {}
+    return dict(db.session.execute(
+        select(ForumPost.title, func.min(ForumPost.id)).where(ForumPost.title.in_(titles)).group_by(ForumPost.title)
+    ).all())
+
+
+def _resolve_users(records):
+    users = _user_ids(record['user'] for record in records)
+    for record in records:
+        record['user_id'] = users.get(record['user'])
+    return [record for record in records if record['user_id'] is not None]
+
+
+def prepare_users(records):
+    existing = set(_user_ids(record['username'] for record in records))
+    rows = []
+    for record in records:
+        if record['username'] in existing:
+            continue
+        # Hashing is by far the slowest step, so it is skipped for users that already exist
+        password_hash = record.get('password_hash') or generate_password_hash(record['password'])
+        rows.append({'username': record['username'], 'email': record['email'], 'password_hash': password_hash})
+    return rows
+
 
-def seed_database():
-    # The entire seed process is wrapped in the application context
+def prepare_plants(records):
+    return [
+        {'user_id': r['user_id'], 'name': r['name'], 'img_url': r.get('img_url'), 'description': r.get('description')}
+        for r in _resolve_users(records)
+    ]
+
+
+def prepare_care_schedules(records):
+    records = _resolve_users(records)
+    plants = _plant_ids((r['user_id'], r['plant_name']) for r in records)
+    rows = []
+    for r in records:
+        plant_id = plants.get((r['user_id'], r['plant_name']))
+        if plant_id is None:
+            print(f"Plant '{r['plant_name']}' not found for user {r['user']}!")
+            continue
+        rows.append({
+            'plant_id': plant_id,
+            'user_id': r['user_id'],
+            'task': r['task'],
+            'schedule_date': datetime.strptime(r['schedule_date'][:10], '%Y-%m-%d').date(),
+            'interval': r.get('interval') or None
+        })
+    return rows
+
+
+def prepare_tips(records):
+    return [
+        {'user_id': r['user_id'], 'title': r['title'], 'content': r['content'], 'created_at': _parse_datetime(r.get('created_at')) or datetime.utcnow()}
+        for r in _resolve_users(records)
+    ]
+
+
+def prepare_forum_posts(records):
+    return [
+        {'user_id': r['user_id'], 'title': r['title'], 'content': r['content'], 'created_at': _parse_datetime(r.get('created_at')) or datetime.utcnow()}
+        for r in _resolve_users(records)
+    ]
+
+
+def prepare_comments(records):
+    records = _resolve_users(records)
+    posts = _post_ids(r['post_title'] for r in records)
+    rows = []
+    for r in records:
+        post_id = posts.get(r['post_title'])
+        if post_id is None:
+            print(f"Post '{r['post_title']}' not found!")
+            continue
+        rows.append({'post_id': post_id, 'user_id': r['user_id'], 'content': r['content'], 'date_created': _parse_datetime(r.get('date_created')) or datetime.utcnow()})
+    return rows
+
+
+def prepare_layouts(records):
+    records = _resolve_users(records)
+    for r in records:
+        if isinstance(r['layout_data'], str):
+            r['layout_data'] = json.loads(r['layout_data'])
+    # Point layout items at the owner's plant ids instead of trusting ids baked into the fixture
+    plants = _plant_ids((r['user_id'], item['name']) for r in records for item in r['layout_data'] if item.get('name'))
+    rows = []
+    for r in records:
+        for item in r['layout_data']:
+            plant_id = plants.get((r['user_id'], item.get('name')))
+            if plant_id is not None:
+                item['plant_id'] = plant_id
+        now = datetime.utcnow()
+        rows.append({
+            'user_id': r['user_id'],
+            'name': r['name'],
+            'layout_data': json.dumps(r['layout_data']),
+            'created_at': _parse_datetime(r.get('created_at')) or now,
+            'updated_at': _parse_datetime(r.get('updated_at')) or now
+        })
+    return rows
+
+
+PREPARE = {
+    'user': prepare_users,
+    'plant': prepare_plants,
+    'care_schedule': prepare_care_schedules,
+    'tip': prepare_tips,
+    'forum_post': prepare_forum_posts,
+    'comment': prepare_comments,
+    'layout': prepare_layouts,
+}
+
+
+class Seeder:
+    """Buffers records per type and writes them in batches, parents first."""
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+        self.buffers = {record_type: [] for record_type in RECORD_TYPES}
+        self.buffered = 0
+        self.inserted = dict.fromkeys(RECORD_TYPES, 0)
+
+    def add(self, record):
+        record_type = record.pop('type')
+        if record_type not in self.buffers:
+            raise ValueError(f'Unknown record type: {record_type}')
+        self.buffers[record_type].append(record)
+        self.buffered += 1
+        if self.buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for record_type in RECORD_TYPES:
+            records = self.buffers[record_type]
+            if not records:
+                continue
+            rows = PREPARE[record_type](records)
+            if rows:
+                table = MODELS[record_type].__table__
+                columns = list(rows[0])
+                statement = insert_ignoring_duplicates(table, NATURAL_KEYS.get(record_type), columns)
+                self.inserted[record_type] += db.session.execute(statement, rows).rowcount
+            self.buffers[record_type] = []
+        self.buffered = 0
+
+
+def log_new_rows(since_ids):
+    """Add change log entries for rows inserted by the seed, which bypassed the ORM flush."""
+    for record_type, since_id in since_ids.items():
+        table = MODELS[record_type].__table__
+        owner = table.c.id if record_type == 'user' else table.c.user_id
+        db.session.execute(ChangeLog.__table__.insert().from_select(
+            ['table_name', 'row_id', 'user_id', 'op', 'changed_at'],
+            select(
+                literal(table.name), table.c.id, owner, literal('upsert'), literal(datetime.utcnow())
+            ).where(table.c.id > since_id)
+        ))
+
+
+def refresh_forum_posts(since_ids, batch_size):
+    """Recount and rescore posts the seed added or commented on; bulk inserts skip the ranking hooks."""
+    touched = select(ForumPost.id).where(ForumPost.id > since_ids['forum_post']).union(
+        select(Comment.post_id).where(Comment.id > since_ids['comment'])
+    )
+    post_ids = db.session.scalars(touched).all()
+    ranking = app.extensions['forum_ranking']
+    for start in range(0, len(post_ids), batch_size):
+        ranking.refresh_activity(post_ids[start:start + batch_size])
+
+
+def read_fixture(path):
+    """Yield records one at a time from an NDJSON or CSV file ('-' reads NDJSON from stdin)."""
+    if path == '-':
+        for line in sys.stdin:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    name, extension = os.path.splitext(os.path.basename(path))
+    with open(path, newline='') as f:
+        if extension == '.csv':
+            default_type = FILE_TYPES.get(name, name)
+            for row in csv.DictReader(f):
+                row.setdefault('type', default_type)
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def seed_database(records=SAMPLE_RECORDS, batch_size=1000):
+    # The entire seed process is wrapped in the application context and a single transaction
     with app.app_context():
         # Create all tables if they don't exist
         db.create_all()
+        router = app.extensions['shards']
+        if router.enabled:
+            router.create_all()
 
-        # Sample users data
-        user_data = [
-            {'username': 'Riko-04', 'email': 'echoge11@gmail.com', 'password': 'Kiptoosky@04'},
-            {'username': 'testuser', 'email': 'testuser@gmail.com', 'password': 'password123'}
-        ]
-
-        for user_info in user_data:
-            user = User.query.filter_by(username=user_info['username']).first()
-            if not user:
-                user = User(username=user_info['username'], email=user_info['email'])
-                user.set_password(user_info['password'])
-                db.session.add(user)
-        db.session.commit()
-
-        # Sample plants data with images
-        plant_data = [
-            {
-                'name': 'Tomato',
-                'img_url': 'https://plus.unsplash.com/premium_photo-1669906333449-5fc2c47cd8ec?q=80&w=387&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D',
-                'description': 'A red, juicy fruit often used in salads and cooking.',
-                'user': 'Riko-04'
-            },
-            {
-                'name': 'Basil',
-                'img_url': 'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRwl3tBPY4s-7hS8sRWGPQgeJ1DX0vBhDpMug&usqp=CAU',
-                'description': 'A fragrant herb commonly used in Italian cuisine.',
-                'user': 'testuser'
-            }
-        ]
-
-        for plant_info in plant_data:
-            user = User.query.filter_by(username=plant_info['user']).first()
-            if user:
-                plant = Plant.query.filter_by(name=plant_info['name'], user_id=user.id).first()
-                if not plant:
-                    plant = Plant(
-                        name=plant_info['name'],
-                        img_url=plant_info['img_url'],
-                        description=plant_info['description'],
-                        user_id=user.id
-                    )
-                    db.session.add(plant)
-        db.session.commit()
-
-        # Sample care schedules
-        care_schedules = [
-            {'plant_name': 'Tomato', 'task': 'Watering', 'schedule_date': datetime(2024, 8, 1), 'interval': 'Daily', 'user': 'Riko-04'},
-            {'plant_name': 'Basil', 'task': 'Pruning', 'schedule_date': datetime(2024, 8, 2), 'interval': 'Fortnightly', 'user': 'testuser'}
-        ]
-
-        for schedule_info in care_schedules:
-            plant = Plant.query.filter_by(name=schedule_info['plant_name']).first()
-            user = User.query.filter_by(username=schedule_info['user']).first() if plant else None
-            if plant and user:
-                schedule = CareSchedule.query.filter_by(plant_id=plant.id, task=schedule_info['task']).first()
-                if not schedule:
-                    schedule = CareSchedule(
-                        plant_id=plant.id,
-                        task=schedule_info['task'],
-                        schedule_date=schedule_info['schedule_date'],
-                        interval=schedule_info['interval'],
-                        user_id=user.id
-                    )
-                    db.session.add(schedule)
-        db.session.commit()
-
-        # Sample tips data
-        tip_data = [
-            {'title': 'Watering Tips', 'content': 'Water your plants regularly.', 'author': 'Riko-04'},
-            {'title': 'Pruning Tips', 'content': 'Prune your plants to promote growth.', 'author': 'testuser'}
-        ]
-
-        for tip_info in tip_data:
-            user = User.query.filter_by(username=tip_info['author']).first()
-            if user:
-                tip = Tip.query.filter_by(title=tip_info['title'], user_id=user.id).first()
-                if not tip:
-                    tip = Tip(
-                        title=tip_info['title'],
-                        content=tip_info['content'],
-                        user_id=user.id
-                    )
-                    db.session.add(tip)
-        db.session.commit()
-
-        # Sample forum posts
-        users = {user.username: user for user in User.query.filter(User.username.in_(['Riko-04', 'testuser'])).all()}
-
-        # Sample forum posts
-        post_data = [
-            {'title': 'Help with tomatoes', 'content': 'My tomatoes are not growing well.', 'user': 'Riko-04'},
-            {'title': 'Basil care', 'content': 'How do I take care of basil?', 'user': 'testuser'}
-        ]
-
-        for post_info in post_data:
-            user = users.get(post_info['user'])
-            if user:
-                post = ForumPost.query.filter_by(title=post_info['title'], user_id=user.id).first()
-                if not post:
-                    post = ForumPost(
-                        title=post_info['title'],
-                        content=post_info['content'],
-                        user_id=user.id
-                    )
-                    db.session.add(post)
-                else:
-                    print(f"Post '{post_info['title']}' already exists for user {post_info['user']}.")
-            else:
-                print(f"User {post_info['user']} not found!")
-
-        db.session.commit()
-
-        # Sample comments data
-        comment_data = [
-            {'post_title': 'Help with tomatoes', 'content': 'Try using more fertilizer.', 'user': 'testuser'},
-            {'post_title': 'Basil care', 'content': 'Make sure it gets enough sunlight.', 'user': 'Riko-04'}
-        ]
-
-        for comment_info in comment_data:
-            post = ForumPost.query.filter_by(title=comment_info['post_title']).first()
-            user = users.get(comment_info['user']) if post else None
-            if post and user:
-                comment = Comment.query.filter_by(post_id=post.id, content=comment_info['content']).first()
-                if not comment:
-                    comment = Comment(
-                        post_id=post.id,
-                        content=comment_info['content'],
-                        user_id=user.id
-                    )
-                    db.session.add(comment)
-                else:
-                    print(f"Comment '{comment_info['content']}' already exists for post '{comment_info['post_title']}'.")
-            else:
-                print(f"Either post '{comment_info['post_title']}' or user '{comment_info['user']}' not found!")
-
-        db.session.commit()
-
-        # Seed data for garden layouts
-        layout_data = [
-            {
-                'name': 'My Vegetable Garden',
-                'user': 'Riko-04',
-                'layout_data': [
-                    {
-                        'plant_id': 1,
-                        'name': 'Tomato',
-                        'img_url': 'https://plus.unsplash.com/premium_photo-1669906333449-5fc2c47cd8ec?q=80&w=387&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D',
-                        'position': {'x': 0, 'y': 1}
-                    }
-                ],
-                'created_at': datetime(2024, 9, 18),
-                'updated_at': datetime(2024, 10, 18)
-            },
-            {
-                'name': 'Herb Garden',
-                'user': 'testuser',
-                'layout_data': [
-                    {
-                        'plant_id': 2,
-                        'name': 'Basil',
-                        'img_url': 'https://encrypted-tbn0.gstatic.com/images?q=tbn:ANd9GcRwl3tBPY4s-7hS8sRWGPQgeJ1DX0vBhDpMug&usqp=CAU',
-                        'position': {'x': 0, 'y': 1}
-                    }
-                ],
-                'created_at': datetime(2024, 9, 18),
-                'updated_at': datetime(2024, 10, 18)
+        # Records are seeded on the primary, then moved to their users' shards
+        with use_shard(CENTRAL):
+            since_ids = {
+                record_type: db.session.query(func.coalesce(func.max(model.id), 0)).scalar()
+                for record_type, model in MODELS.items()
             }
-        ]
-
-        # Adding the seed data to the database
-        for layout_info in layout_data:
-            user = User.query.filter_by(username=layout_info['user']).first()
-            if user:
-                layout = Layout.query.filter_by(name=layout_info['name'], user_id=user.id).first()
-                if not layout:
-                    layout = Layout(
-                        name=layout_info['name'],
-                        layout_data=json.dumps(layout_info['layout_data']),  # Convert layout_data to JSON string here
-                        user_id=user.id,
-                        created_at=layout_info['created_at'],
-                        updated_at=layout_info['updated_at']
-                    )
-                    db.session.add(layout)
-
-        db.session.commit()
-
+            seeder = Seeder(batch_size)
+            try:
+                for record in records:
+                    seeder.add(dict(record))
+                seeder.flush()
+                link_species()
+                fill_comment_paths()
+                refresh_forum_posts(since_ids, batch_size)
+                log_new_rows(since_ids)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        if router.enabled:
+            moved = sum(1 for _ in rebalance())
+            print(f'Moved {moved} users to their shards')
 
+    for record_type, count in seeder.inserted.items():
+        print(f'{record_type}: {count} new')
     print("Database seeded successfully!")
 
+
 if __name__ == '__main__':
-    seed_database()
+    parser = argparse.ArgumentParser(description='Seed the GreenThumb database.')
+    parser.add_argument('--fixtures', nargs='+', metavar='FILE',
+                        help="NDJSON or CSV files to load instead of the sample data ('-' for NDJSON on stdin)")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.fixtures:
+        seed_database(itertools.chain.from_iterable(read_fixture(path) for path in args.fixtures), args.batch_size)
+    else:
+        seed_database(batch_size=args.batch_size)
@@ -0,0 +1,263 @@
+import hashlib
+import json
+from contextlib import contextmanager
+import click
+import sqlalchemy as sa
+from flask import current_app, has_request_context
+from flask.cli import AppGroup
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.sql.util import find_tables
+from models import db, Plant, CareSchedule, Layout, record_changes
+from backup import Importer, export_lines
+from replicas import _resolve_sqlite_url
+
+shards_cli = AppGroup('shards', help='Manage per-user data shards.')
+
+# Per-user tables, plus the species catalogue plants join against, so every query stays on one database
+SHARDED_TABLES = {'plant', 'care_schedule', 'layout', 'species'}
+MOVED_RECORD_TYPES = {'plant', 'care_schedule', 'layout'}
+CENTRAL = 'central'  # Pseudo shard name for the primary database
+
+
+def parse_shard_uris(value):
+    """'a=sqlite:///a.db,b=postgresql://...' -> {'a': ..., 'b': ...}; unnamed entries become shard0, shard1..."""
+    shards = {}
+    for i, entry in enumerate(uri for uri in value.split(',') if uri):
+        name, sep, uri = entry.partition('=')
+        if not sep or '://' in name:
+            name, uri = f'shard{i}', entry
+        shards[name] = uri
+    return shards
+
+
+def shard_metadata():
+    """The sharded tables without their foreign keys to central tables, which a shard does not have."""
+    metadata = sa.MetaData()
+    for name in SHARDED_TABLES:
+        db.metadata.tables[name].to_metadata(metadata)
+    for table in metadata.tables.values():
+        for constraint in list(table.foreign_key_constraints):
+            if constraint.elements[0].target_fullname.split('.')[0] not in SHARDED_TABLES:
+                table.constraints.discard(constraint)
+                for element in constraint.elements:
+                    element.parent.foreign_keys.discard(element)
+                    table.foreign_keys.discard(element)
+    return metadata
+
+
+class ShardRouter:
+    """Optional sharding of per-user rows across SQLALCHEMY_SHARD_URIS.
+
+    Each user's plants, care schedules and layouts live on the shard picked
+    by rendezvous hashing of their id, so adding a shard only moves the users
+    that now hash to it. Users, tips, the forum and the change log stay on
+    the primary. Queries on sharded tables go to the shard of the JWT user,
+    or of the shard pinned with use_shard()/pin_user_shard().
+
+    Row ids are only unique within a shard; everything that reads them is
+    scoped to one user. Shard schemas are created with `flask shards init`
+    rather than migrations, and `flask shards rebalance` moves users whose
+    rows are on the wrong database, including the primary.
+    """
+
+    def __init__(self, app=None):
+        self.engines = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_SHARD_URIS', {})
+        self.app = app
+        self.engines = {
+            name: sa.create_engine(_resolve_sqlite_url(uri, app.instance_path))
+            for name, uri in app.config['SQLALCHEMY_SHARD_URIS'].items()
+        }
+        app.extensions['shards'] = self
+        app.cli.add_command(shards_cli)
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    @property
+    def names(self):
+        return list(self.engines)
+
+    def shard_for(self, user_id):
+        # Highest-random-weight hashing; blake2b rather than hash() so every process agrees
+        def weight(name):
+            return hashlib.blake2b(f'{name}:{user_id}'.encode(), digest_size=8).digest()
+        return max(self.engines, key=weight)
+
+    def get_bind(self, session, mapper, clause):
+        """The shard engine for a statement on sharded tables, or None to use the primary."""
+        if mapper is not None:
+            tables = [mapper.local_table]
+        elif clause is not None:
+            tables = find_tables(clause, include_crud=True)
+        else:
+            return None
+        if not any(table.name in SHARDED_TABLES for table in tables):
+            return None
+        shard = self.current_shard(session)
+        return None if shard == CENTRAL else self.engines[shard]
+
+    def current_shard(self, session):
+        shard = session.info.get('shard')
+        if shard is not None:
+            return shard
+        user_id = None
+        if has_request_context():
+            try:
+                user_id = get_jwt_identity()
+            except RuntimeError:  # Route without @jwt_required
+                pass
+        if user_id is None:
+            raise RuntimeError('Sharded table used without a user; call pin_user_shard() or use_shard() first')
+        return self.shard_for(user_id)
+
+    def create_all(self):
+        metadata = shard_metadata()
+        for engine in self.engines.values():
+            metadata.create_all(engine)
+
+
+def _router():
+    router = current_app.extensions.get('shards')
+    return router if router is not None and router.enabled else None
+
+
+@contextmanager
+def use_shard(name):
+    """Send sharded-table queries in this block to shard `name` (or CENTRAL)."""
+    info = db.session.info
+    previous = info.get('shard')
+    info['shard'] = name
+    try:
+        yield
+    finally:
+        if previous is None:
+            info.pop('shard', None)
+        else:
+            info['shard'] = previous
+
+
+def pin_user_shard(user_id):
+    """For routes authenticated by other means than a JWT: use this user's shard for the rest of the request."""
+    router = _router()
+    if router is not None:
+        db.session.info['shard'] = router.shard_for(user_id)
+
+
+def each_shard():
+    """Run the loop body once per shard, or once on the primary when sharding is off."""
+    router = _router()
+    if router is None:
+        yield None
+        return
+    for name in router.names:
+        with use_shard(name):
+            yield name
+
+
+def _users_on(database):
+    with use_shard(database):
+        user_ids = set()
+        for model in (Plant, CareSchedule, Layout):
+            user_ids.update(db.session.execute(sa.select(model.user_id).distinct()).scalars())
+        return user_ids
+
+
+def move_user(user_id, source, target):
+    """Copy one user's rows from `source` to `target`, then delete them from `source`.
+
+    Moved rows get new ids; tombstones for the old ones are logged before the
+    new rows, since ids may repeat and later change log entries win.
+
+    This is not atomic. There is no two-phase commit, so each of the two
+    commits below writes the primary's change log and one shard separately,
+    and the copy and the delete are separate commits:
+
+    - Interrupted before the copy commits: the source is untouched and a
+      rerun starts over. The change log may already name rows that do not
+      exist on the target; /sync skips those.
+    - Interrupted between the copy and the delete: the user's rows are on
+      both databases, and the client already sees the target copy. A rerun
+      of rebalance() would copy them again, so first delete the user's rows
+      from the source by hand; `flask shards status` lists them as misplaced.
+
+    Either way rows are never lost. The target is not cleared before a
+    retry, because once a user hashes to it their new rows are written
+    there.
+    """
+    with use_shard(source):
+        records = [json.loads(line) for line in export_lines(user_id)]
+        old_rows = {
+            model.__tablename__: [(row_id, user_id) for row_id in db.session.execute(sa.select(model.id).where(model.user_id == user_id)).scalars()]
+            for model in (CareSchedule, Layout, Plant)
+        }
+    for table_name, rows in old_rows.items():
+        record_changes(db.session, table_name, rows, 'delete')
+    with use_shard(target):
+        importer = Importer(user_id)
+        for record in records:
+            if record['type'] in MOVED_RECORD_TYPES:
+                importer.add(record)
+        importer.finish()
+    db.session.commit()
+
+    with use_shard(source):
+        for model in (CareSchedule, Layout, Plant):
+            db.session.execute(sa.delete(model).where(model.user_id == user_id))
+    db.session.commit()
+    return importer.progress()
+
+
+def rebalance():
+    """Move every user whose rows are not on the shard they hash to; yields (user_id, source, target)."""
+    router = _router()
+    for source in [CENTRAL] + router.names:
+        for user_id in sorted(_users_on(source)):
+            target = router.shard_for(user_id)
+            if target != source:
+                move_user(user_id, source, target)
+                yield user_id, source, target
+
+
+@shards_cli.command('init')
+def init_shards():
+    """Create the sharded tables on every shard."""
+    if _router() is None:
+        raise click.ClickException('No shards configured in SQLALCHEMY_SHARD_URIS.')
+    _router().create_all()
+    click.echo(f'Created sharded tables on {", ".join(_router().names)}')
+
+
+@shards_cli.command('status')
+def shard_status():
+    """Show how many users and rows each database holds, and how many users are misplaced."""
+    router = _router()
+    if router is None:
+        raise click.ClickException('No shards configured in SQLALCHEMY_SHARD_URIS.')
+    for database in [CENTRAL] + router.names:
+        user_ids = _users_on(database)
+        misplaced = sum(1 for user_id in user_ids if router.shard_for(user_id) != database)
+        with use_shard(database):
+            counts = ', '.join(
+                f'{model.__tablename__}={db.session.execute(sa.select(sa.func.count()).select_from(model)).scalar()}'
+                for model in (Plant, CareSchedule, Layout)
+            )
+        click.echo(f'{database}: {len(user_ids)} users ({misplaced} misplaced), {counts}')
+
+
+@shards_cli.command('rebalance')
+def rebalance_shards():
+    """Move users to the shard they hash to, e.g. after adding a shard or turning sharding on."""
+    if _router() is None:
+        raise click.ClickException('No shards configured in SQLALCHEMY_SHARD_URIS.')
+    moved = 0
+    for user_id, source, target in rebalance():
+        moved += 1
+        click.echo(f'Moved user {user_id}: {source} -> {target}')
+    current_app.extensions['typeahead'].invalidate()
+    click.echo(f'Moved {moved} users')
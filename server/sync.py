@@ -0,0 +1,81 @@
+from sqlalchemy import func, or_
+from sqlalchemy.orm import joinedload
+from models import db, ChangeLog, Plant, CareSchedule, Layout, Tip, ForumPost, Comment
+
+# Tables offered to offline clients, keyed by table name
+SYNC_MODELS = {
+    'plant': Plant,
+    'care_schedule': CareSchedule,
+    'layout': Layout,
+    'tip': Tip,
+    'forum_post': ForumPost,
+    'comment': Comment,
+}
+
+# Rows in these tables belong to one user; the rest are shared by everyone
+USER_SCOPED_TABLES = {'plant', 'care_schedule', 'layout'}
+
+# Relationships to_dict() reads, loaded with the rows instead of one query per row
+EAGER_LOADS = {'care_schedule': 'plant', 'tip': 'user', 'forum_post': 'user', 'comment': 'user'}
+
+
+def latest_token():
+    return db.session.query(func.max(ChangeLog.id)).scalar() or 0
+
+
+def _query(table):
+    model = SYNC_MODELS[table]
+    if table not in EAGER_LOADS:
+        return model.query
+    return model.query.options(joinedload(getattr(model, EAGER_LOADS[table])))
+
+
+def _empty_changes():
+    return {table: {'upserts': [], 'deletes': []} for table in SYNC_MODELS}
+
+
+def full_snapshot(user_id):
+    """Every row visible to the user, for clients syncing for the first time."""
+    token = latest_token()
+    changes = _empty_changes()
+    for table, model in SYNC_MODELS.items():
+        query = _query(table)
+        if table in USER_SCOPED_TABLES:
+            query = query.filter_by(user_id=user_id)
+        changes[table]['upserts'] = [row.to_dict() for row in query.all()]
+    return {'token': token, 'changes': changes}
+
+
+def changes_since(user_id, since):
+    """Rows created, updated or deleted after the `since` token, collapsed to their latest state."""
+    token = latest_token()
+    entries = (
+        db.session.query(ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op)
+        .filter(ChangeLog.id > since, ChangeLog.id <= token)
+        .filter(ChangeLog.table_name.in_(SYNC_MODELS.keys()))
+        .filter(or_(
+            ChangeLog.table_name.notin_(USER_SCOPED_TABLES),
+            ChangeLog.user_id == user_id
+        ))
+        .order_by(ChangeLog.id)
+        .all()
+    )
+
+    # Later entries win, so an insert followed by a delete is just a tombstone
+    last_op = {}
+    for table, row_id, op in entries:
+        last_op[(table, row_id)] = op
+
+    changes = _empty_changes()
+    upsert_ids = {}
+    for (table, row_id), op in last_op.items():
+        if op == 'delete':
+            changes[table]['deletes'].append(row_id)
+        else:
+            upsert_ids.setdefault(table, []).append(row_id)
+
+    for table, ids in upsert_ids.items():
+        model = SYNC_MODELS[table]
+        changes[table]['upserts'] = [row.to_dict() for row in _query(table).filter(model.id.in_(ids)).all()]
+
+    return {'token': token, 'changes': changes}
@@ -0,0 +1,169 @@
+"""Sharding and replica copying against throwaway SQLite databases.
+
+Run from this directory with `python -m unittest test_shards`. The app reads
+its database settings at import time, so they are set before importing it.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import date
+
+WORKDIR = tempfile.mkdtemp()
+
+
+def _database(name):
+    return os.path.join(WORKDIR, f'{name}.db')
+
+
+os.environ['DATABASE_URL'] = f'sqlite:///{_database("primary")}'
+os.environ['SQLALCHEMY_SHARD_URIS'] = f'a=sqlite:///{_database("a")},b=sqlite:///{_database("b")}'
+os.environ['SQLALCHEMY_REPLICA_URIS'] = f'sqlite:///{_database("replica")}'
+
+from flask_jwt_extended import create_access_token  # noqa: E402
+from app import app  # noqa: E402
+from models import db, User, Plant, CareSchedule, ChangeLog  # noqa: E402
+from shards import CENTRAL, move_user, rebalance, use_shard  # noqa: E402
+
+
+def tearDownModule():
+    with app.app_context():
+        db.engine.dispose()
+    for engine in app.extensions['shards'].engines.values():
+        engine.dispose()
+    shutil.rmtree(WORKDIR)
+
+
+def _rows(name, sql):
+    conn = sqlite3.connect(_database(name))
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+class ShardTestCase(unittest.TestCase):
+    """Fresh schemas on the primary and both shards for every test."""
+
+    def setUp(self):
+        app.config['TESTING'] = True
+        app.config['RATELIMIT_ENABLED'] = False
+        app.config['JWT_TOKEN_LOCATION'] = ['headers']
+        self.router = app.extensions['shards']
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            sharded = [db.metadata.tables[name] for name in ('care_schedule', 'layout', 'plant', 'species')]
+            for engine in self.router.engines.values():
+                db.metadata.drop_all(engine, tables=sharded)
+            self.router.create_all()
+        self.client = app.test_client()
+
+    def make_user(self, shard):
+        """A user whose id hashes to `shard`, with an auth header for it."""
+        with app.app_context():
+            while True:
+                number = User.query.count() + 1
+                user = User(username=f'user{number}', email=f'user{number}@example.com')
+                user.set_password('pw')
+                db.session.add(user)
+                db.session.commit()
+                if self.router.shard_for(user.id) == shard:
+                    return user.id, {'Authorization': f'Bearer {create_access_token(identity=user.id)}'}
+
+    def add_plants(self, user_id, database, names):
+        """Insert plants, each with a care schedule, straight onto `database`."""
+        with app.app_context(), use_shard(database):
+            for name in names:
+                plant = Plant(name=name, user_id=user_id)
+                db.session.add(plant)
+                db.session.flush()
+                db.session.add(CareSchedule(task='Water', schedule_date=date(2026, 10, 20), plant_id=plant.id, user_id=user_id))
+            db.session.commit()
+
+
+class RoutingTest(ShardTestCase):
+
+    def test_rendezvous_hashing_is_stable_and_uses_both_shards(self):
+        placement = {user_id: self.router.shard_for(user_id) for user_id in range(1, 101)}
+        self.assertEqual(set(placement.values()), {'a', 'b'})
+        self.assertEqual(placement, {user_id: self.router.shard_for(user_id) for user_id in range(1, 101)})
+
+    def test_user_rows_land_on_their_shard(self):
+        user_a, headers_a = self.make_user('a')
+        user_b, headers_b = self.make_user('b')
+        for headers in (headers_a, headers_b):
+            response = self.client.post('/plants', json={'name': 'Tomato', 'img_url': 'tomato.jpg'}, headers=headers)
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(_rows('a', 'SELECT user_id, name FROM plant'), [(user_a, 'Tomato')])
+        self.assertEqual(_rows('b', 'SELECT user_id, name FROM plant'), [(user_b, 'Tomato')])
+        self.assertEqual(_rows('primary', 'SELECT count(*) FROM plant'), [(0,)])
+        # Each shard keeps its own copy of the species catalogue
+        self.assertEqual(_rows('a', 'SELECT name FROM species'), [('Tomato',)])
+        self.assertEqual(_rows('b', 'SELECT name FROM species'), [('Tomato',)])
+
+    def test_sharded_query_without_a_user_is_refused(self):
+        with app.app_context():
+            with self.assertRaises(RuntimeError):
+                Plant.query.all()
+
+
+class MoveTest(ShardTestCase):
+
+    def test_move_user_copies_rows_then_deletes_the_source(self):
+        user_id, _ = self.make_user('a')
+        self.add_plants(user_id, 'b', ['Basil', 'Sage'])
+        old_ids = [row_id for row_id, in _rows('b', 'SELECT id FROM plant ORDER BY id')]
+
+        with app.app_context():
+            logged_before = db.session.execute(db.select(db.func.max(ChangeLog.id))).scalar()
+            progress = move_user(user_id, 'b', 'a')
+            log = db.session.execute(
+                db.select(ChangeLog.table_name, ChangeLog.row_id, ChangeLog.op)
+                .where(ChangeLog.id > logged_before).order_by(ChangeLog.id)
+            ).all()
+
+        self.assertEqual(progress['imported']['plant'], 2)
+        self.assertEqual(_rows('b', 'SELECT count(*) FROM plant'), [(0,)])
+        self.assertEqual(_rows('b', 'SELECT count(*) FROM care_schedule'), [(0,)])
+        self.assertEqual(sorted(name for name, in _rows('a', 'SELECT name FROM plant')), ['Basil', 'Sage'])
+        # Care schedules follow their plants' new ids
+        self.assertEqual(
+            _rows('a', 'SELECT count(*) FROM care_schedule JOIN plant ON plant.id = care_schedule.plant_id'), [(2,)]
+        )
+        # Tombstones for the old ids come before the upserts for the new ones
+        plant_log = [(row_id, op) for table_name, row_id, op in log if table_name == 'plant']
+        self.assertEqual(plant_log[:2], [(row_id, 'delete') for row_id in old_ids])
+        self.assertEqual({op for _, op in plant_log[2:]}, {'upsert'})
+
+    def test_rebalance_moves_only_misplaced_users(self):
+        user_a, _ = self.make_user('a')
+        user_b, _ = self.make_user('b')
+        self.add_plants(user_a, CENTRAL, ['Fern'])
+        self.add_plants(user_b, 'b', ['Mint'])
+
+        with app.app_context():
+            moved = list(rebalance())
+            self.assertEqual(moved, [(user_a, CENTRAL, 'a')])
+            self.assertEqual(list(rebalance()), [])
+
+        self.assertEqual(_rows('primary', 'SELECT count(*) FROM plant'), [(0,)])
+        self.assertEqual(_rows('a', 'SELECT user_id, name FROM plant'), [(user_a, 'Fern')])
+        self.assertEqual(_rows('b', 'SELECT user_id, name FROM plant'), [(user_b, 'Mint')])
+
+
+class ReplicaCopyTest(ShardTestCase):
+
+    def test_copy_snapshots_the_primary_onto_the_replica(self):
+        self.make_user('a')
+        result = app.test_cli_runner().invoke(args=['replicas', 'copy'])
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn(_database('replica'), result.output)
+        self.assertEqual(_rows('replica', 'SELECT username FROM user'), _rows('primary', 'SELECT username FROM user'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+from models import db, Comment, User, COMMENT_PATH_SEGMENT, comment_subtree_range
+
+MAX_DEPTH = 10  # Replies nest at most this deep; paths stay well inside the column
+
+
+def _comment_rows(*criteria, root_depth, max_replies=None, max_depth=None):
+    """Comments matching `criteria` in path order, cut to `max_replies` per parent and `max_depth` in SQL.
+
+    Each reply carries its reply number among its siblings and how many
+    siblings it has, numbered over every row in range, so the cut keeps
+    the earliest replies of each comment.
+    """
+    depth = db.func.length(Comment.path) // COMMENT_PATH_SEGMENT
+    siblings = {'partition_by': Comment.parent_id}
+    comments = (
+        db.select(
+            Comment.id, Comment.parent_id, Comment.path, Comment.content, Comment.date_created,
+            Comment.version, Comment.user_id, depth.label('depth'),
+            db.func.row_number().over(order_by=Comment.path, **siblings).label('reply_number'),
+            db.func.count().over(**siblings).label('sibling_count')
+        )
+        .where(*criteria)
+    )
+    if max_depth is not None:
+        comments = comments.where(depth <= max_depth)
+    comments = comments.subquery()
+
+    query = (
+        db.select(comments, User.username)
+        .join(User, User.id == comments.c.user_id)
+        .order_by(comments.c.path)
+    )
+    if max_replies is not None:
+        query = query.where(db.or_(comments.c.depth == root_depth, comments.c.reply_number <= max_replies))
+    return db.session.execute(query)
+
+
+def build_tree(rows, root_depth):
+    """Nest rows sorted by path in one pass; parents always come before their replies.
+
+    Rows at `root_depth` become the roots. `reply_count` says how many replies
+    a comment has in range, once at least one of them was loaded.
+    """
+    roots = []
+    nodes = {}
+    for row in rows:
+        node = {
+            'id': row.id,
+            'parent_id': row.parent_id,
+            'content': row.content,
+            'author': row.username,
+            'date_created': row.date_created,
+            'version': row.version,
+            'reply_count': 0,
+            'replies': [],
+        }
+        if row.depth == root_depth:
+            roots.append(node)
+        else:
+            parent = nodes.get(row.parent_id)
+            if parent is None:  # An ancestor was left out, so this reply is too
+                continue
+            parent['reply_count'] = row.sibling_count
+            parent['replies'].append(node)
+        nodes[row.id] = node
+    return roots
+
+
+def post_threads(post_id, limit, max_replies=None, max_depth=None):
+    """The first `limit` top-level comments of a post with their replies, from one range query.
+
+    The range ends at the path of the first top-level comment left out, so the
+    query walks ix_comment_post_id_path from the start of the post to there.
+    """
+    boundary = (
+        db.select(Comment.path)
+        .where(Comment.post_id == post_id, Comment.parent_id.is_(None))
+        .order_by(Comment.path)
+        .offset(limit)
+        .limit(1)
+        .scalar_subquery()
+    )
+    rows = _comment_rows(
+        Comment.post_id == post_id,
+        Comment.path < db.func.coalesce(boundary, '~'),  # '~' sorts after every path
+        root_depth=1, max_replies=max_replies, max_depth=max_depth
+    )
+    return build_tree(rows, 1)
+
+
+def comment_thread(comment, max_replies=None, max_depth=None):
+    """A comment and everything under it, from one range query."""
+    lower, upper = comment_subtree_range(comment.path)
+    rows = _comment_rows(
+        Comment.post_id == comment.post_id, Comment.path >= lower, Comment.path < upper,
+        root_depth=comment.depth, max_replies=max_replies,
+        max_depth=None if max_depth is None else comment.depth + max_depth
+    )
+    roots = build_tree(rows, comment.depth)
+    return roots[0] if roots else None
+
+
+def subtree_rows(comment):
+    """(id, user_id, date_created) of a comment and all its replies, e.g. before deleting them."""
+    lower, upper = comment_subtree_range(comment.path)
+    return db.session.execute(
+        db.select(Comment.id, Comment.user_id, Comment.date_created)
+        .where(Comment.post_id == comment.post_id, Comment.path >= lower, Comment.path < upper)
+    ).all()
@@ -0,0 +1,201 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from flask import request
+from models import db, Plant, Tip, ForumPost
+from shards import each_shard
+
+# Column indexed for each suggestion type
+SOURCES = {'plant': Plant.name, 'tip': Tip.title, 'forum_post': ForumPost.title}
+MAX_LABEL_LENGTH = 100
+
+
+def normalize(text):
+    return ' '.join(text.lower().split())
+
+
+class PrefixIndex:
+    """Sorted array of (normalized text, ref) searched with bisect."""
+
+    def __init__(self):
+        self.entries = []
+        self.labels = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, normalized, ref, label, keep_sorted=True):
+        """Add an entry; bulk loads pass keep_sorted=False and call sort() once at the end."""
+        entry = (normalized, ref)
+        if entry not in self.labels:
+            if keep_sorted:
+                insort(self.entries, entry)
+            else:
+                self.entries.append(entry)
+            self.labels[entry] = label[:MAX_LABEL_LENGTH]
+
+    def sort(self):
+        self.entries.sort()
+
+    def remove(self, normalized, ref):
+        entry = (normalized, ref)
+        if self.labels.pop(entry, None) is not None:
+            del self.entries[bisect_left(self.entries, entry)]
+
+    def search(self, prefix, limit):
+        results = []
+        # (prefix,) sorts before every (prefix..., ref) tuple
+        for i in range(bisect_left(self.entries, (prefix,)), len(self.entries)):
+            normalized, ref = self.entries[i]
+            if not normalized.startswith(prefix) or len(results) >= limit:
+                break
+            results.append((normalized, ref, self.labels[(normalized, ref)]))
+        return results
+
+
+class IndexState:
+    """Everything a rebuild replaces at once."""
+
+    def __init__(self):
+        self.indexes = {kind: PrefixIndex() for kind in SOURCES if kind != 'plant'}
+        self.plants = {}  # user_id -> PrefixIndex of their plants, so nobody is offered another user's
+        self.refs = {kind: {} for kind in SOURCES}  # ref -> normalized text, to undo updates and deletes
+        self.size = 0
+
+    def index_for(self, kind, row_id, create=False):
+        """The index holding row_id and the ref it is stored under there."""
+        if kind != 'plant':
+            return self.indexes[kind], row_id
+        user_id, plant_id = row_id
+        if create:
+            return self.plants.setdefault(user_id, PrefixIndex()), plant_id
+        return self.plants.get(user_id), plant_id
+
+
+class Typeahead:
+    """In-memory prefix index over plant names, tip titles and forum post titles.
+
+    Routes keep it current with put()/discard(); plants are referred to by
+    (user_id, plant id), as plant ids are only unique within a shard, and each
+    user is only offered their own plants. Each
+    worker holds its own copy, so it is also rebuilt from the database every
+    TYPEAHEAD_REBUILD_SECONDS to pick up other workers' writes and bulk changes.
+    Rebuilds, the first one included, run in a background thread, so a worker
+    suggests nothing until its first build is done rather than holding up the
+    request that started it. TYPEAHEAD_MAX_ENTRIES caps memory; rows past the
+    cap are not suggested.
+    """
+
+    def __init__(self, app=None):
+        self.state = None
+        self.lock = threading.Lock()
+        self.built_at = 0
+        self.rebuilding = False
+        self.missed = None  # (method, args) for writes made while a build is reading
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TYPEAHEAD_MAX_ENTRIES', 200000)
+        app.config.setdefault('TYPEAHEAD_REBUILD_SECONDS', 300)
+        self.app = app
+        app.extensions['typeahead'] = self
+        app.before_request(self._before_request)
+
+    def _before_request(self):
+        stale = self.state is None or time.monotonic() - self.built_at > self.app.config['TYPEAHEAD_REBUILD_SECONDS']
+        if stale and not self.rebuilding:
+            self.rebuilding = True
+            threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            with self.app.app_context():
+                self.rebuild()
+        finally:
+            self.rebuilding = False
+
+    def invalidate(self):
+        """Rebuild in the background from the next request on, for changes too broad to apply one row at a time."""
+        self.built_at = 0
+
+    def rebuild(self):
+        with self.lock:
+            self.missed = []
+        state = IndexState()
+        for kind, column in SOURCES.items():
+            if kind == 'plant':
+                for _ in each_shard():
+                    rows = db.session.execute(db.select(Plant.user_id, Plant.id, Plant.name).execution_options(yield_per=1000))
+                    for user_id, plant_id, name in rows:
+                        self._put(state, kind, (user_id, plant_id), name, keep_sorted=False)
+                continue
+            rows = db.session.execute(db.select(column.class_.id, column).execution_options(yield_per=1000))
+            for row_id, text in rows:
+                self._put(state, kind, row_id, text, keep_sorted=False)
+        for index in [*state.indexes.values(), *state.plants.values()]:
+            index.sort()
+        with self.lock:
+            # Writes that landed while the rebuild was reading; _put() replaces and _discard() ignores unknown rows
+            for method, args in self.missed:
+                method(state, *args)
+            self.missed = None
+            self.state = state
+            self.built_at = time.monotonic()
+
+    def _put(self, state, kind, row_id, text, keep_sorted=True):
+        self._discard(state, kind, row_id)
+        if not text or state.size >= self.app.config['TYPEAHEAD_MAX_ENTRIES']:
+            return
+        normalized = normalize(text)
+        state.refs[kind][row_id] = normalized
+        state.size += 1
+        index, ref = state.index_for(kind, row_id, create=True)
+        index.add(normalized, ref, text.strip(), keep_sorted)
+
+    def _discard(self, state, kind, row_id):
+        normalized = state.refs[kind].pop(row_id, None)
+        if normalized is None:
+            return
+        state.size -= 1
+        index, ref = state.index_for(kind, row_id)
+        index.remove(normalized, ref)
+        if kind == 'plant' and not index:
+            del state.plants[row_id[0]]
+
+    def put(self, kind, row_id, text):
+        self._apply(self._put, kind, row_id, text)
+
+    def discard(self, kind, row_id):
+        self._apply(self._discard, kind, row_id)
+
+    def _apply(self, method, *args):
+        with self.lock:
+            if self.missed is not None:
+                self.missed.append((method, args))
+            if self.state is not None:
+                method(self.state, *args)
+
+    def search(self, query, kinds, limit, user_id):
+        """Suggestions of the given kinds; plant suggestions are only user_id's own plants."""
+        prefix = normalize(query)
+        if not prefix or self.state is None:
+            return []
+        with self.lock:
+            matches = []
+            for kind in kinds:
+                index = self.state.plants.get(user_id) if kind == 'plant' else self.state.indexes[kind]
+                if index is not None:
+                    matches.extend((normalized, kind, ref, label) for normalized, ref, label in index.search(prefix, limit))
+        matches.sort()
+        return [
+            {'type': kind, 'id': ref, 'text': label}
+            for _, kind, ref, label in matches[:limit]
+        ]
+
+
+def requested_kinds():
+    kinds = request.args.get('types')
+    if not kinds:
+        return list(SOURCES)
+    return [kind for kind in kinds.split(',') if kind in SOURCES]
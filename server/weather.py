@@ -0,0 +1,246 @@
+import calendar
+import json
+import os
+import urllib.parse
+import urllib.request
+from datetime import date, datetime, timedelta
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import AppGroup
+from models import db, User, CareSchedule, WeatherForecast, record_changes, weather_cell, weather_cell_centre
+from calendar_feed import RRULES
+from shards import CENTRAL, use_shard
+
+weather_cli = AppGroup('weather', help='Adjust care schedules to the weather.')
+
+WATERING_TASK = '%water%'  # Matched case-insensitively against CareSchedule.task
+EPOCH = date(1970, 1, 1)
+STEP_DAYS = {'daily': 1, 'weekly': 7, 'fortnightly': 14}
+
+
+class WeatherProvider:
+    """Source of daily rain forecasts; subclasses implement daily_rain()."""
+
+    def daily_rain(self, latitude, longitude, days):
+        """[(date, rain in mm), ...] for today and the following days."""
+        raise NotImplementedError
+
+
+class FixtureWeatherProvider(WeatherProvider):
+    """Forecasts from a JSON file, for offline development and testing.
+
+    The file maps grid cells (or '*' for any other cell) to lists of
+    {"date": "2026-10-20", "rain_mm": 12.5}; {"day": 1, ...} means tomorrow.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def daily_rain(self, latitude, longitude, days):
+        with open(self.path) as f:
+            fixture = json.load(f)
+        today = date.today()
+        entries = fixture.get(weather_cell(latitude, longitude), fixture.get('*', []))
+        forecast = []
+        for entry in entries:
+            if 'date' in entry:
+                day = date.fromisoformat(entry['date'])
+            else:
+                day = today + timedelta(days=entry['day'])
+            if today <= day < today + timedelta(days=days):
+                forecast.append((day, float(entry['rain_mm'])))
+        return sorted(forecast)
+
+
+class OpenMeteoWeatherProvider(WeatherProvider):
+    """Daily precipitation sums from the Open-Meteo forecast API (no key needed)."""
+
+    URL = 'https://api.open-meteo.com/v1/forecast'
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def daily_rain(self, latitude, longitude, days):
+        query = urllib.parse.urlencode({
+            'latitude': f'{latitude:.4f}', 'longitude': f'{longitude:.4f}',
+            'daily': 'precipitation_sum', 'forecast_days': days, 'timezone': 'UTC',
+        })
+        with urllib.request.urlopen(f'{self.URL}?{query}', timeout=self.timeout) as response:
+            daily = json.load(response)['daily']
+        return [
+            (date.fromisoformat(day), rain or 0.0)
+            for day, rain in zip(daily['time'], daily['precipitation_sum'])
+        ]
+
+
+def _month_dates(start, direction):
+    """The same day of the month as `start` in following (1) or preceding (-1) months, skipping months
+    without that day, as FREQ=MONTHLY does."""
+    year, month = start.year, start.month
+    while True:
+        month += direction
+        if month == 0 or month == 13:
+            year += direction
+            month = 12 if month == 0 else 1
+        if start.day <= calendar.monthrange(year, month)[1]:
+            yield date(year, month, start.day)
+
+
+def following_dates(start, interval):
+    """Occurrences after `start` of a schedule that occurs on `start`; one-off tasks can move to any later day."""
+    if interval == 'monthly':
+        yield from _month_dates(start, 1)
+        return
+    step = timedelta(days=STEP_DAYS.get(interval, 1))
+    day = start
+    while True:
+        day += step
+        yield day
+
+
+def previous_date(start, interval):
+    if interval == 'monthly':
+        return next(_month_dates(start, -1))
+    return start - timedelta(days=STEP_DAYS[interval])
+
+
+def adjustments(wet_days, today):
+    """(condition, new schedule_date) pairs for watering tasks whose next occurrence falls on a wet day.
+
+    One-off tasks are shifted to the next day that is not wet. Recurring tasks
+    skip the wet occurrence: their start date moves to the next occurrence that
+    is not wet, so the rest of the series stays as it was. Only the next
+    occurrence can be skipped this way, so a start date in the past only
+    matches when the wet day is the first occurrence from today on.
+    """
+    schedule_date = CareSchedule.schedule_date
+    interval = sa.func.lower(sa.func.trim(CareSchedule.interval))
+    start_days = sa.cast(sa.extract('epoch', schedule_date), sa.Integer) // 86400
+    pairs = []
+    for day in sorted(wet_days):
+        # None stands for one-off tasks, including intervals the calendar does not understand either
+        for kind in [None, *RRULES]:
+            new_date = sa.literal(next(d for d in following_dates(day, kind) if d not in wet_days), sa.Date)
+            if kind is None:
+                pairs.append((sa.and_(sa.or_(interval.is_(None), interval.not_in(list(RRULES))), schedule_date == day), new_date))
+                continue
+            if kind == 'monthly':
+                occurs = sa.and_(schedule_date <= day, sa.extract('day', schedule_date) == day.day)
+            elif kind == 'daily':
+                occurs = schedule_date <= day
+            else:
+                occurs = sa.and_(schedule_date <= day, ((day - EPOCH).days - start_days) % STEP_DAYS[kind] == 0)
+            if previous_date(day, kind) >= today:
+                occurs = schedule_date == day  # An earlier occurrence comes first
+            pairs.append((sa.and_(interval == kind, occurs), new_date))
+    return pairs
+
+
+class WeatherAdjuster:
+    """Moves watering tasks off rainy days, using one forecast per grid cell.
+
+    Users opt in by setting a location, stored only as its grid cell. Each
+    cell's forecast comes from WEATHER_PROVIDER ('fixture', 'open-meteo' or a
+    WeatherProvider instance) and is cached in the database for WEATHER_FORECAST_TTL seconds, so it is
+    fetched once per cell whatever the number of users. `flask weather
+    adjust`, meant to run from cron, then rewrites the watering tasks of all
+    users in a cell with a single UPDATE (per shard when sharding is on).
+    """
+
+    def __init__(self, app=None):
+        self.provider = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('WEATHER_PROVIDER', None)
+        app.config.setdefault('WEATHER_FIXTURE_PATH', os.path.join(app.instance_path, 'weather_fixture.json'))
+        app.config.setdefault('WEATHER_HTTP_TIMEOUT', 10)
+        app.config.setdefault('WEATHER_FORECAST_TTL', 3 * 3600)
+        app.config.setdefault('WEATHER_FORECAST_DAYS', 7)
+        app.config.setdefault('WEATHER_RAIN_MM', 5.0)  # Rain from this much on, watering is skipped that day
+        self.app = app
+        name = app.config['WEATHER_PROVIDER']
+        if isinstance(name, WeatherProvider):  # Any other source plugs in as an instance
+            self.provider = name
+        elif name == 'fixture':
+            self.provider = FixtureWeatherProvider(app.config['WEATHER_FIXTURE_PATH'])
+        elif name == 'open-meteo':
+            self.provider = OpenMeteoWeatherProvider(app.config['WEATHER_HTTP_TIMEOUT'])
+        elif name is not None:
+            raise ValueError(f'Unknown WEATHER_PROVIDER: {name}')
+        app.extensions['weather'] = self
+        app.cli.add_command(weather_cli)
+
+    def forecast(self, cell, now=None):
+        """[(date, rain mm), ...] for a cell, from the cache while it is fresh."""
+        now = now or datetime.utcnow()
+        cached = db.session.get(WeatherForecast, cell)
+        if cached is not None and now - cached.fetched_at < timedelta(seconds=self.app.config['WEATHER_FORECAST_TTL']):
+            return [(date.fromisoformat(day), rain) for day, rain in json.loads(cached.days)]
+
+        latitude, longitude = weather_cell_centre(cell)
+        days = self.provider.daily_rain(latitude, longitude, self.app.config['WEATHER_FORECAST_DAYS'])
+        if cached is None:
+            cached = WeatherForecast(cell=cell)
+            db.session.add(cached)
+        cached.fetched_at = now
+        cached.days = json.dumps([(day.isoformat(), rain) for day, rain in days])
+        return days
+
+    def _user_groups(self, cell):
+        """(shard, criterion) pairs that together select the care schedules of everyone in the cell."""
+        users = sa.select(User.id).where(User.weather_cell == cell)
+        router = current_app.extensions['shards']
+        if not router.enabled:
+            yield CENTRAL, CareSchedule.user_id.in_(users)
+            return
+        by_shard = {}
+        for user_id in db.session.execute(users).scalars():
+            by_shard.setdefault(router.shard_for(user_id), []).append(user_id)
+        for shard, user_ids in by_shard.items():
+            yield shard, CareSchedule.user_id.in_(user_ids)
+
+    def adjust_cell(self, cell, today=None):
+        """Move the cell's watering tasks off wet days; returns how many schedules changed."""
+        today = today or date.today()
+        wet_days = {day for day, rain in self.forecast(cell) if day >= today and rain >= self.app.config['WEATHER_RAIN_MM']}
+        if not wet_days:
+            return 0
+        pairs = adjustments(wet_days, today)
+        changed = 0
+        for shard, users in self._user_groups(cell):
+            with use_shard(shard):
+                rows = db.session.execute(
+                    sa.update(CareSchedule)
+                    .where(users, CareSchedule.task.ilike(WATERING_TASK), sa.or_(*(condition for condition, _ in pairs)))
+                    .values(schedule_date=sa.case(*pairs), version=CareSchedule.version + 1)
+                    .returning(CareSchedule.id, CareSchedule.user_id)
+                    .execution_options(synchronize_session=False)
+                ).all()
+            # Bulk updates skip the flush events; this also refreshes the users' calendar feeds
+            record_changes(db.session, 'care_schedule', rows, 'upsert')
+            changed += len(rows)
+        return changed
+
+
+@weather_cli.command('adjust')
+def adjust_schedules():
+    """Shift or skip watering tasks due on rainy days (run from cron, e.g. daily)."""
+    adjuster = current_app.extensions['weather']
+    if adjuster.provider is None:
+        raise click.ClickException('No WEATHER_PROVIDER configured.')
+    cells = db.session.execute(sa.select(User.weather_cell).where(User.weather_cell.is_not(None)).distinct()).scalars().all()
+    total = 0
+    for cell in cells:
+        try:
+            changed = adjuster.adjust_cell(cell)
+        except (OSError, ValueError, KeyError) as e:
+            # One unreachable or malformed forecast should not hold up every other cell
+            db.session.rollback()
+            current_app.logger.warning('Weather forecast for cell %s failed: %s', cell, e)
+            continue
+        db.session.commit()
+        total += changed
+    click.echo(f'Adjusted {total} watering tasks in {len(cells)} cells')